@@ -0,0 +1,416 @@
+"""Benchmark the IR codecs and the send pipeline.
+
+    python -m benchmarks.bench [--codes-dir codes] [--save-baseline]
+
+Frames are sampled from the device code library with a fixed seed, so two
+runs on the same tree measure the same commands. Every benchmark reports
+the throughput of its fastest round in operations per second, per frame
+latency percentiles and the memory allocated while converting or sending
+one frame. Sends go to stubs of hass.services.async_call, MQTT publishing
+and the HTTP transport, and are not paced by the send scheduler.
+
+Results are compared against benchmarks/baseline.json when it exists, and a
+benchmark whose throughput dropped or whose allocations grew by more than
+the threshold is reported as a regression. Save a baseline on the machine
+the benchmarks are run on, the numbers are not portable between machines.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+
+from custom_components.smartir import Helper, codec
+from custom_components.smartir.controllers import (
+    abstract_controller,
+    mqtt_controller,
+    HTTP_TRANSPORT, SEND_SCHEDULER,
+    ENC_BASE64, ENC_PRONTO, ENC_RAW,
+    BROADLINK_CONTROLLER, XIAOMI_CONTROLLER, MQTT_CONTROLLER, LOOKIN_CONTROLLER,
+    ESPHOME_CONTROLLER,
+    get_controller,
+)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_CODES_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'codes')
+
+PLATFORMS = ['climate', 'fan', 'media_player']
+
+# (controller, controller_type, controller_data) of the entities sending the frames
+TARGETS = [
+    (BROADLINK_CONTROLLER, None, 'remote.bench'),
+    (XIAOMI_CONTROLLER, None, 'remote.bench'),
+    (MQTT_CONTROLLER, None, 'bench/ir'),
+    (MQTT_CONTROLLER, 'IRremoteESP8266', 'bench/ir'),
+    (LOOKIN_CONTROLLER, None, '192.0.2.1'),
+    (ESPHOME_CONTROLLER, None, 'send_raw_command'),
+]
+
+
+class _Services():
+    """Stands in for hass.services, counts the service calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def async_call(self, domain, service, service_data=None, **kwargs):
+        self.calls += 1
+
+
+class _ConfigEntries():
+    def async_entries(self, domain=None):
+        return []
+
+
+class _Hass():
+    def __init__(self):
+        self.services = _Services()
+        self.config_entries = _ConfigEntries()
+        self.data = {}
+
+    async def async_add_executor_job(self, target, *args):
+        self.services.calls += 1
+
+
+async def _publish(hass, topic, payload, qos=0, retain=False):
+    hass.services.calls += 1
+
+
+async def _http_get(url):
+    return 200
+
+
+@contextmanager
+def stubbed_transports():
+    """Send through stubs of MQTT and HTTP, without pausing between sends."""
+    min_gap = SEND_SCHEDULER.min_gap
+    mqtt = mqtt_controller._mqtt
+    SEND_SCHEDULER.configure(0)
+    mqtt_controller._mqtt = lambda: types.SimpleNamespace(async_publish=_publish)
+    HTTP_TRANSPORT.get = _http_get
+    try:
+        yield
+    finally:
+        SEND_SCHEDULER.configure(min_gap)
+        mqtt_controller._mqtt = mqtt
+        del HTTP_TRANSPORT.get
+
+
+class _Entity():
+    """Stands in for an entity sending the commands of a device file."""
+
+    def __init__(self, source, target, hass):
+        self._supported_controller, self._supported_controller_type, \
+            self._commands_encoding = source
+        self._controller_type = target[1]
+        self._controller_data = target[2]
+        self._delay = 0
+        self.hass = hass
+
+
+class Frame():
+    __slots__ = ('source', 'command')
+
+    def __init__(self, source, command):
+        self.source = source
+        self.command = command
+
+
+def _leaves(node):
+    for value in node.values():
+        if type(value) is dict:
+            yield from _leaves(value)
+        elif value is not None:
+            yield value
+
+
+def sample_frames(codes_dir, per_source, seed):
+    """Return up to `per_source` frames of every (controller, controller type,
+    encoding) found in the code library."""
+    frames = defaultdict(list)
+    for platform_name in PLATFORMS:
+        platform_dir = os.path.join(codes_dir, platform_name)
+        if not os.path.isdir(platform_dir):
+            continue
+        for name in sorted(os.listdir(platform_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(platform_dir, name)) as j:
+                    device_data = json.load(j)
+                source = (device_data['supportedController'],
+                          device_data.get('controllerType'),
+                          device_data['commandsEncoding'])
+                commands = device_data['commands']
+            except (ValueError, KeyError, TypeError):
+                continue
+            frames[source].extend(Frame(source, command) for command in _leaves(commands))
+
+    rng = random.Random(seed)
+    sampled = {}
+    for source in sorted(frames, key=repr):
+        commands = frames[source]
+        sampled[source] = rng.sample(commands, min(per_source, len(commands)))
+    return sampled
+
+
+def _works(func, *args):
+    try:
+        func(*args)
+        return True
+    except Exception:
+        return False
+
+
+@contextmanager
+def cold_cache():
+    """Bypass the transcoding cache, so that every decode converts the frame."""
+    cache = abstract_controller.TRANSCODE_CACHE
+    abstract_controller.TRANSCODE_CACHE = abstract_controller.TranscodeCache(0)
+    try:
+        yield
+    finally:
+        abstract_controller.TRANSCODE_CACHE = cache
+
+
+class Benchmark():
+    """A named list of (function, args) calls, each converting or sending a frame."""
+
+    def __init__(self, name, calls, is_async=False, setup=None):
+        self.name = name
+        self.calls = calls
+        self.is_async = is_async
+        self.setup = setup or nullcontext
+
+    def _timed_round(self, loop):
+        latencies = []
+        clock = time.perf_counter_ns
+        if self.is_async:
+            async def run():
+                for func, args in self.calls:
+                    start = clock()
+                    await func(*args)
+                    latencies.append(clock() - start)
+            loop.run_until_complete(run())
+        else:
+            for func, args in self.calls:
+                start = clock()
+                func(*args)
+                latencies.append(clock() - start)
+        return latencies
+
+    def _allocated(self, loop):
+        """Mean peak of the memory allocated by one call."""
+        peaks = []
+        tracemalloc.start()
+        try:
+            for func, args in self.calls:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                if self.is_async:
+                    loop.run_until_complete(func(*args))
+                else:
+                    func(*args)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+        return statistics.mean(peaks)
+
+    def run(self, loop, rounds):
+        with self.setup():
+            self._timed_round(loop)  # warm up
+            latencies = []
+            totals = []
+            for _ in range(rounds):
+                round_latencies = self._timed_round(loop)
+                totals.append(sum(round_latencies))
+                latencies.extend(round_latencies)
+            allocated = self._allocated(loop)
+
+        latencies.sort()
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] / 1000
+        return {
+            'frames': len(self.calls),
+            'ops_per_sec': len(self.calls) / (min(totals) / 1e9),
+            'p50_us': percentile(50),
+            'p90_us': percentile(90),
+            'p99_us': percentile(99),
+            'max_us': latencies[-1] / 1000,
+            'alloc_bytes': allocated,
+        }
+
+
+def build_benchmarks(frames, loop):
+    hass = _Hass()
+    benchmarks = []
+
+    # Codecs
+    broadlink = [f.command for f in frames.get((BROADLINK_CONTROLLER, None, ENC_BASE64), [])
+                 if _works(Helper.broadlink2lirc, f.command)]
+    benchmarks.append(Benchmark('Helper.broadlink2lirc',
+                                [(Helper.broadlink2lirc, (c,)) for c in broadlink]))
+
+    pronto = [bytearray.fromhex(f.command.replace(' ', ''))
+              for source, sampled in frames.items() if source[2] == ENC_PRONTO
+              for f in sampled]
+    pronto = [p for p in pronto if _works(Helper.pronto2lirc, p)]
+    benchmarks.append(Benchmark('Helper.pronto2lirc',
+                                [(Helper.pronto2lirc, (p,)) for p in pronto]))
+
+    lirc = []
+    for source, sampled in frames.items():
+        controller = abstract_controller.AbstractController.controllers.get(source[0])
+        if controller is None:
+            continue
+        toLirc_calls = []
+        for frame in sampled:
+            entity = _Entity(source, (source[0], source[1], None), hass)
+            try:
+                ok, pulses = controller.toLirc(frame.command, entity)
+            except Exception:
+                continue
+            if ok:
+                toLirc_calls.append((controller.toLirc, (frame.command, entity)))
+                lirc.append(pulses)
+        if toLirc_calls:
+            benchmarks.append(Benchmark('{}.toLirc[{}]'.format(
+                controller.__name__, '/'.join(p for p in source if p)), toLirc_calls))
+
+    benchmarks.append(Benchmark('Helper.lirc2broadlink', [
+        (Helper.lirc2broadlink, (p,)) for p in lirc if _works(Helper.lirc2broadlink, p)]))
+
+    # Controllers
+    for target in TARGETS:
+        controller = get_controller(target[0])
+        label = '/'.join(p for p in target[:2] if p)
+        # frames the controller can send
+        decodable = []
+        for source, sampled in frames.items():
+            for frame in sampled:
+                entity = _Entity(source, target, hass)
+                with cold_cache():
+                    if _works(loop.run_until_complete, controller.send(frame.command, entity)):
+                        decodable.append((frame.command, entity))
+        if not decodable:
+            continue
+
+        if 'fromLirc' in type(controller).__dict__:
+            entity = _Entity((target[0], target[1], ENC_RAW), target, hass)
+            benchmarks.append(Benchmark('{}.fromLirc'.format(label), [
+                (controller.fromLirc, (list(p), entity)) for p in lirc
+                if _works(controller.fromLirc, list(p), entity)]))
+        calls = [(controller.decode, args) for args in decodable]
+        benchmarks.append(Benchmark('{}.decode cold'.format(label), calls, setup=cold_cache))
+        benchmarks.append(Benchmark('{}.decode warm'.format(label), calls))
+
+        sends = [(controller.send, args) for args in decodable]
+        benchmarks.append(Benchmark('{}.send cold'.format(label), sends, True, cold_cache))
+        benchmarks.append(Benchmark('{}.send warm'.format(label), sends, True))
+
+    return [b for b in benchmarks if b.calls]
+
+
+def compare(results, baseline, threshold):
+    """Return {name: [regressions]} of the results that got worse than the baseline."""
+    regressions = {}
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        found = []
+        if result['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            found.append('ops/sec {:.0f} -> {:.0f}'.format(
+                before['ops_per_sec'], result['ops_per_sec']))
+        if result['alloc_bytes'] > before['alloc_bytes'] * (1 + threshold) + 64:
+            found.append('allocated {:.0f} -> {:.0f} bytes'.format(
+                before['alloc_bytes'], result['alloc_bytes']))
+        if found:
+            regressions[name] = found
+    return regressions
+
+
+def _print_results(results, baseline):
+    print("{:<48} {:>6} {:>11} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+        'benchmark', 'frames', 'ops/sec', 'p50 us', 'p90 us', 'p99 us', 'alloc B', 'change'))
+    for name, r in results.items():
+        change = ''
+        if name in baseline:
+            change = '{:+.1%}'.format(r['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1)
+        print("{:<48} {:>6} {:>11.0f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.0f} {:>8}".format(
+            name, r['frames'], r['ops_per_sec'], r['p50_us'], r['p90_us'], r['p99_us'],
+            r['alloc_bytes'], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the SmartIR codecs and send pipeline.")
+    parser.add_argument('--codes-dir', default=DEFAULT_CODES_DIR,
+                        help="the codes directory to sample frames from")
+    parser.add_argument('--frames', type=int, default=200,
+                        help="frames sampled per controller and encoding")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rounds', type=int, default=5,
+                        help="timed rounds per benchmark")
+    parser.add_argument('-k', dest='only', default=None,
+                        help="only run the benchmarks whose name contains this")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="relative change reported as a regression")
+    parser.add_argument('--json', action='store_true',
+                        help="print the results as Json")
+    args = parser.parse_args(argv)
+
+    frames = sample_frames(args.codes_dir, args.frames, args.seed)
+    loop = asyncio.new_event_loop()
+    try:
+        with stubbed_transports():
+            benchmarks = build_benchmarks(frames, loop)
+            if args.only:
+                benchmarks = [b for b in benchmarks if args.only in b.name]
+            results = {b.name: b.run(loop, args.rounds) for b in benchmarks}
+    finally:
+        loop.close()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.json:
+        json.dump({'results': results, 'regressions': regressions}, sys.stdout, indent=2)
+        print()
+    else:
+        _print_results(results, baseline)
+        for name, found in regressions.items():
+            print("REGRESSION {}: {}".format(name, ', '.join(found)))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'numpy': codec.np is not None,
+                'frames': args.frames,
+                'seed': args.seed,
+                'results': results,
+            }, f, indent=2)
+        print("Saved the baseline to " + args.baseline)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
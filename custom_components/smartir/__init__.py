@@ -1,23 +1,24 @@
 import aiofiles
 import aiohttp
 import asyncio
-import binascii
 from distutils.version import StrictVersion
 import json
 import logging
 import os.path
-from itsdangerous import base64_decode
 import requests
-import struct
 import voluptuous as vol
-import math
 
 from aiohttp import ClientSession
 from homeassistant.const import (
-    ATTR_FRIENDLY_NAME, __version__ as current_ha_version)
+    ATTR_FRIENDLY_NAME, EVENT_HOMEASSISTANT_STOP, __version__ as current_ha_version)
+from homeassistant.core import callback
+from homeassistant.helpers import discovery
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.typing import ConfigType
 
+from . import codec
+
 _LOGGER = logging.getLogger(__name__)
 
 DOMAIN = 'smartir'
@@ -35,12 +36,28 @@ COMPONENT_ABS_DIR = os.path.dirname(
 
 CONF_CHECK_UPDATES = 'check_updates'
 CONF_UPDATE_BRANCH = 'update_branch'
+CONF_HTTP_TIMEOUT = 'http_timeout'
+CONF_HTTP_CONNECTIONS_PER_HOST = 'http_connections_per_host'
+CONF_MIN_FRAME_GAP = 'min_frame_gap'
+CONF_MQTT_QOS = 'mqtt_qos'
+CONF_MQTT_RETAIN = 'mqtt_retain'
+CONF_MQTT_RAW = 'mqtt_raw'
+CONF_METRICS = 'metrics'
+CONF_LOOP_WATCHDOG = 'loop_watchdog'
 
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Optional(CONF_CHECK_UPDATES, default=True): cv.boolean,
         vol.Optional(CONF_UPDATE_BRANCH, default='master'): vol.In(
-            ['master', 'rc'])
+            ['master', 'rc']),
+        vol.Optional(CONF_HTTP_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+        vol.Optional(CONF_HTTP_CONNECTIONS_PER_HOST): vol.All(int, vol.Range(min=1)),
+        vol.Optional(CONF_MIN_FRAME_GAP): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_MQTT_QOS): vol.All(vol.Coerce(int), vol.In([0, 1, 2])),
+        vol.Optional(CONF_MQTT_RETAIN): cv.boolean,
+        vol.Optional(CONF_MQTT_RAW): vol.Any(cv.boolean, vol.All(cv.ensure_list, [cv.string])),
+        vol.Optional(CONF_METRICS, default=False): cv.boolean,
+        vol.Optional(CONF_LOOP_WATCHDOG): vol.All(vol.Coerce(float), vol.Range(min=0.01)),
     })
 }, extra=vol.ALLOW_EXTRA)
 
@@ -55,8 +72,71 @@ CONF_HUMIDITY_SENSOR = 'humidity_sensor'
 CONF_POWER_SENSOR = 'power_sensor'
 CONF_POWER_SENSOR_RESTORE_STATE = 'power_sensor_restore_state'
 
+ATTR_COMMAND = 'command'
+ATTR_ENCODING = 'encoding'
+ATTR_PLATFORM = 'platform'
+ATTR_LIMIT = 'limit'
+ATTR_MODE = 'mode'
+ATTR_DURATION = 'duration'
+ATTR_INTERVAL = 'interval'
+EVENT_IDENTIFIED = 'smartir_identified'
+
+IDENTIFY_SCHEMA = vol.Schema({
+    vol.Required(ATTR_COMMAND): vol.Any(cv.string, [vol.Coerce(int)]),
+    vol.Optional(ATTR_ENCODING): vol.In(['Base64', 'Hex', 'Pronto', 'Raw']),
+    vol.Optional(ATTR_PLATFORM): vol.In(['climate', 'fan', 'media_player']),
+    vol.Optional(ATTR_LIMIT, default=5): cv.positive_int,
+})
+
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_MODE, default='sampling'): vol.In(['sampling', 'cprofile']),
+    vol.Optional(ATTR_DURATION, default=30): vol.All(
+        vol.Coerce(float), vol.Range(min=1, max=3600)),
+    vol.Optional(ATTR_INTERVAL, default=0.005): vol.All(
+        vol.Coerce(float), vol.Range(min=0.001, max=1)),
+})
+
 async def async_setup(hass, config):
     """Set up the SmartIR component."""
+    from .controllers import (
+        TRANSCODE_STORE, HTTP_TRANSPORT, SEND_SCHEDULER, MQTT_CONTROLLER, get_controller)
+    from .device_data import DEVICE_DATA, configured_devices
+    from . import updater
+
+    async def _flush_transcode_store(event):
+        await TRANSCODE_STORE.async_flush(hass)
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _flush_transcode_store)
+
+    async def _close_http_transport(event):
+        await HTTP_TRANSPORT.async_close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _close_http_transport)
+
+    # Download the missing device files of all platforms at once, the
+    # platforms wait for these downloads instead of starting their own.
+    devices = configured_devices(config)
+    if devices:
+        hass.async_create_task(DEVICE_DATA.async_prefetch(hass, devices))
+
+    async def _identify(service):
+        await _async_identify(hass, service.data)
+
+    hass.services.async_register(DOMAIN, 'identify', _identify, schema=IDENTIFY_SCHEMA)
+
+    async def _profile(service):
+        hass.async_create_task(_async_profile(hass, service.data))
+
+    hass.services.async_register(DOMAIN, 'profile', _profile, schema=PROFILE_SCHEMA)
+
+    try:
+        if await hass.async_add_executor_job(updater.recover):
+            _LOGGER.warning("Finished installing an interrupted update of SmartIR. "
+                            "Please restart Home Assistant.")
+    except Exception:
+        _LOGGER.error("Unable to recover from an interrupted update of SmartIR. "
+                      "Please update the component manually.")
+
     conf = config.get(DOMAIN)
 
     if conf is None:
@@ -64,6 +144,26 @@ async def async_setup(hass, config):
 
     check_updates = conf[CONF_CHECK_UPDATES]
     update_branch = conf[CONF_UPDATE_BRANCH]
+    HTTP_TRANSPORT.configure(
+        conf.get(CONF_HTTP_TIMEOUT), conf.get(CONF_HTTP_CONNECTIONS_PER_HOST))
+    SEND_SCHEDULER.configure(conf.get(CONF_MIN_FRAME_GAP))
+    get_controller(MQTT_CONTROLLER).configure(
+        conf.get(CONF_MQTT_QOS), conf.get(CONF_MQTT_RETAIN), conf.get(CONF_MQTT_RAW))
+
+    if conf[CONF_METRICS]:
+        hass.async_create_task(
+            discovery.async_load_platform(hass, 'sensor', DOMAIN, {}, config))
+
+    if conf.get(CONF_LOOP_WATCHDOG):
+        from .watchdog import LOOP_WATCHDOG
+        LOOP_WATCHDOG.configure(conf[CONF_LOOP_WATCHDOG])
+        LOOP_WATCHDOG.start(hass.loop)
+
+        @callback
+        def _stop_watchdog(event):
+            LOOP_WATCHDOG.stop()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _stop_watchdog)
 
     async def _check_updates(service):
         await _update(hass, update_branch)
@@ -79,143 +179,125 @@ async def async_setup(hass, config):
 
     return True
 
+async def _async_identify(hass, data):
+    from .fingerprint import FINGERPRINTS, parse_frame
+
+    try:
+        pulses = parse_frame(data[ATTR_COMMAND], data.get(ATTR_ENCODING))
+    except Exception as e:
+        _LOGGER.error("Unable to identify the IR frame: %s", e)
+        return
+
+    try:
+        index = await FINGERPRINTS.async_get(hass)
+    except Exception:
+        _LOGGER.exception("Unable to build the IR fingerprint index")
+        return
+
+    matches = index.query(pulses, data[ATTR_LIMIT], data.get(ATTR_PLATFORM))
+    hass.bus.async_fire(EVENT_IDENTIFIED, {'matches': matches})
+
+    if not matches:
+        message = "No device code matches the IR frame."
+    else:
+        message = "Device codes matching the IR frame, best first:\n\n" + "\n".join(
+            "- {} **{}** ({:.0%} of the pulses match): {}".format(
+                m['platform'], m['device_code'], m['score'], ', '.join(m['commands'][:3]))
+            for m in matches)
+    hass.components.persistent_notification.async_create(message, title='SmartIR')
+
+async def _async_profile(hass, data):
+    from .profiler import PROFILING
+
+    if PROFILING.running:
+        _LOGGER.warning("SmartIR is already being profiled")
+        return
+
+    _LOGGER.info("Profiling SmartIR for %s seconds", data[ATTR_DURATION])
+    try:
+        path = await PROFILING.async_profile(
+            hass, data[ATTR_MODE], data[ATTR_DURATION], data[ATTR_INTERVAL])
+    except Exception:
+        _LOGGER.exception("Unable to profile SmartIR")
+        return
+
+    _LOGGER.info("The SmartIR profile was written to %s", path)
+    hass.components.persistent_notification.async_create(
+        "The SmartIR profile was written to `{}`.".format(path), title='SmartIR')
+
 async def _update(hass, branch, do_update=False, notify_if_latest=True):
+    from . import updater
+
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(MANIFEST_URL.format(branch)) as response:
-                if response.status == 200:
-
-                    data = await response.json(content_type='text/plain')
-                    min_ha_version = data['homeassistant']
-                    last_version = data['updater']['version']
-                    release_notes = data['updater']['releaseNotes']
-
-                    if StrictVersion(last_version) <= StrictVersion(VERSION):
-                        if notify_if_latest:
-                            hass.components.persistent_notification.async_create(
-                                "You're already using the latest version!",
-                                title='SmartIR')
-                        return
-
-                    if StrictVersion(current_ha_version) < StrictVersion(min_ha_version):
-                        hass.components.persistent_notification.async_create(
-                            "There is a new version of SmartIR integration, but it is **incompatible** "
-                            "with your system. Please first update Home Assistant.", title='SmartIR')
-                        return
+        session = async_get_clientsession(hass)
+        async with session.get(MANIFEST_URL.format(branch)) as response:
+            if response.status == 200:
 
-                    if do_update is False:
-                        hass.components.persistent_notification.async_create(
-                            "A new version of SmartIR integration is available ({}). "
-                            "Call the ``smartir.update_component`` service to update "
-                            "the integration. \n\n **Release notes:** \n{}"
-                            .format(last_version, release_notes), title='SmartIR')
-                        return
-
-                    # Begin update
-                    files = data['updater']['files']
-                    has_errors = False
-
-                    for file in files:
-                        try:
-                            source = REMOTE_BASE_URL.format(branch) + file
-                            dest = os.path.join(COMPONENT_ABS_DIR, file)
-                            os.makedirs(os.path.dirname(dest), exist_ok=True)
-                            await Helper.downloader(source, dest)
-                        except Exception:
-                            has_errors = True
-                            _LOGGER.error("Error updating %s. Please update the file manually.", file)
-
-                    if has_errors:
-                        hass.components.persistent_notification.async_create(
-                            "There was an error updating one or more files of SmartIR. "
-                            "Please check the logs for more information.", title='SmartIR')
-                    else:
+                data = await response.json(content_type='text/plain')
+                min_ha_version = data['homeassistant']
+                last_version = data['updater']['version']
+                release_notes = data['updater']['releaseNotes']
+
+                if StrictVersion(last_version) <= StrictVersion(VERSION):
+                    if notify_if_latest:
                         hass.components.persistent_notification.async_create(
-                            "Successfully updated to {}. Please restart Home Assistant."
-                            .format(last_version), title='SmartIR')
+                            "You're already using the latest version!",
+                            title='SmartIR')
+                    return
+
+                if StrictVersion(current_ha_version) < StrictVersion(min_ha_version):
+                    hass.components.persistent_notification.async_create(
+                        "There is a new version of SmartIR integration, but it is **incompatible** "
+                        "with your system. Please first update Home Assistant.", title='SmartIR')
+                    return
+
+                if do_update is False:
+                    hass.components.persistent_notification.async_create(
+                        "A new version of SmartIR integration is available ({}). "
+                        "Call the ``smartir.update_component`` service to update "
+                        "the integration. \n\n **Release notes:** \n{}"
+                        .format(last_version, release_notes), title='SmartIR')
+                    return
+
+                # Begin update
+                files = data['updater']['files']
+                failed = await updater.async_update_files(
+                    hass, session, REMOTE_BASE_URL.format(branch), files)
+
+                if failed:
+                    hass.components.persistent_notification.async_create(
+                        "There was an error updating one or more files of SmartIR. "
+                        "Please check the logs for more information.", title='SmartIR')
+                else:
+                    hass.components.persistent_notification.async_create(
+                        "Successfully updated to {}. Please restart Home Assistant."
+                        .format(last_version), title='SmartIR')
     except Exception:
        _LOGGER.error("An error occurred while checking for updates.")
 
 class Helper():
     @staticmethod
-    async def downloader(source, dest):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(source) as response:
-                if response.status == 200:
-                    async with aiofiles.open(dest, mode='wb') as f:
-                        await f.write(await response.read())
-                else:
-                    raise Exception("File not found")
+    async def downloader(source, dest, session=None):
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await Helper.downloader(source, dest, session)
+
+        async with session.get(source) as response:
+            if response.status == 404:
+                raise FileNotFoundError("{} not found".format(source))
+            # other errors, such as 429 or 5xx, may go away when retried
+            response.raise_for_status()
+            async with aiofiles.open(dest, mode='wb') as f:
+                await f.write(await response.read())
 
     @staticmethod
     def pronto2lirc(pronto):
-        codes = [int(binascii.hexlify(pronto[i:i+2]), 16) for i in range(0, len(pronto), 2)]
-
-        if codes[0]:
-            raise ValueError("Pronto code should start with 0000")
-        if len(codes) != 4 + 2 * (codes[2] + codes[3]):
-            raise ValueError("Number of pulse widths does not match the preamble")
-
-        frequency = 1 / (codes[1] * 0.241246)
-        return [int(round(code / frequency)) for code in codes[4:]]
+        return codec.pronto2lirc(pronto)
 
     @staticmethod
     def lirc2broadlink(pulses):
-        array = bytearray()
-
-        for pulse in pulses:
-            pulse = int(pulse * 269 / 8192)
-
-            if pulse < 256:
-                array += bytearray(struct.pack('>B', pulse))
-            else:
-                array += bytearray([0x00])
-                array += bytearray(struct.pack('>H', pulse))
-
-        packet = bytearray([0x26, 0x00])
-        packet += bytearray(struct.pack('<H', len(array)))
-        packet += array
-        packet += bytearray([0x0d, 0x05])
-
-        # Add 0s to make ultimate packet size a multiple of 16 for 128-bit AES encryption.
-        remainder = (len(packet) + 4) % 16
-        if remainder:
-            packet += bytearray(16 - remainder)
-        return packet
+        return codec.lirc2broadlink(pulses)
 
     @staticmethod
     def broadlink2lirc(command):
-        result = list()
-        pulses = base64_decode(command) if type(command) is str else command
-        isIR = False
-        ix = 0
-        current = pulses[ix]
-        ix += 1
-        if current == 0x26:
-            # Mark the IR flag and set the 0 to the pules frequency
-            isIR = True
-        #     result.append(0)
-        else:
-            raise Exception("This broadlink data is not IR data")
-        #     result.append(currentByte)
-        ix += 1 # skip repeat byte
-        ix += 2 # skip length word(big endian)
-        mPulses = memoryview(pulses)
-        while ix < len(pulses):
-            current = pulses[ix]
-            # If its '00' it means the next hex pules value was larger then one byte
-            # So the broadlink mark by '00' byte that the next byte belong his following byte
-            # For example the 0x123 value will be in shown as '00' '01' '23'
-            # so we need to skip the '00' flag and combine the next tow bytes to one hex value
-            if current == 0:
-                ix+=1
-                subview = mPulses[ix:ix+2] # point to the word(big-endian)
-                current = struct.unpack('>H', subview)[0]
-                ix+=1
-            # Get the pulse lengths (revers the formula: µs * 2^-15)
-            current = math.floor(current / 269 * 8192)
-            result.append(current)
-            if isIR and mPulses[ix:ix+3] == b'\x00\x0d\x05':
-                break
-            ix+=1
-        return result
+        return codec.broadlink2lirc(command)
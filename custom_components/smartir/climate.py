@@ -1,7 +1,5 @@
 import asyncio
-import json
 import logging
-import os.path
 import math
 import time
 
@@ -34,11 +32,11 @@ from homeassistant.helpers.event import (
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.restore_state import RestoreEntity
 from . import (
-    COMPONENT_ABS_DIR, Helper,
     CONF_UNIQUE_ID, CONF_DEVICE_CODE, CONF_CONTROLLER, CONF_CONTROLLER_TYPE, CONF_CONTROLLER_DATA,
     CONF_DELAY, CONF_TEMPERATURE_SENSOR, CONF_HUMIDITY_SENSOR, CONF_POWER_SENSOR, CONF_POWER_SENSOR_RESTORE_STATE
 )
-from .controllers import get_controller
+from .device_data import DEVICE_DATA, device_source
+from .controllers import get_controller, SEND_TRACER
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -52,6 +50,7 @@ DEFAULT_MIN_RUN_TIME = 1800 # seconds,30min
 DEFAULT_MODE = 'auto'
 DEFAULT_HOT_COMFORT_TEMPERATURE = 26
 DEFAULT_COLD_COMFORT_TEMPERATURE = 26
+DEFAULT_SEND_DEBOUNCE = 0 # seconds, disabled
 
 CONF_USE_TEMPERATURE_SENSOR = "use_temperature_sensor"
 CONF_COLD_TOLERANCE = "cold_tolerance"
@@ -69,6 +68,7 @@ CONF_FULL_SPEED_START = "full_speed_start"
 CONF_HOT_COMFORT_TEMPERATURE = "hot_comfort_temperature"
 CONF_COLD_COMFORT_TEMPERATURE = "cold_comfort_temperature"
 CONF_PRECISION = "precision"
+CONF_SEND_DEBOUNCE = "send_debounce"
 
 SUPPORT_FLAGS = (
     SUPPORT_TARGET_TEMPERATURE |
@@ -106,6 +106,7 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(ATTR_MAX_TEMP): vol.Coerce(float),
     vol.Optional(ATTR_TARGET_TEMP_STEP): vol.Coerce(float),
     vol.Optional(CONF_PRECISION): vol.Coerce(float),
+    vol.Optional(CONF_SEND_DEBOUNCE, default=DEFAULT_SEND_DEBOUNCE): cv.positive_float,
 })
 
 def get_by_precision(temperature: float, precision: float = PRECISION_WHOLE):
@@ -121,39 +122,9 @@ def get_by_precision(temperature: float, precision: float = PRECISION_WHOLE):
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Climate platform."""
-    device_code = config.get(CONF_DEVICE_CODE)
-    device_files_subdir = os.path.join('codes', 'climate')
-    device_files_absdir = os.path.join(COMPONENT_ABS_DIR, device_files_subdir)
-
-    if not os.path.isdir(device_files_absdir):
-        os.makedirs(device_files_absdir)
-
-    device_json_filename = str(device_code) + '.json'
-    device_json_path = os.path.join(device_files_absdir, device_json_filename)
-
-    if not os.path.exists(device_json_path):
-        _LOGGER.warning("Couldn't find the device Json file. The component will " \
-                        "try to download it from the GitHub repo.")
-
-        try:
-            codes_source = ("https://raw.githubusercontent.com/"
-                            "smartHomeHub/SmartIR/master/"
-                            "codes/climate/{}.json")
-
-            await Helper.downloader(codes_source.format(device_code), device_json_path)
-        except Exception:
-            _LOGGER.error("There was an error while downloading the device Json file. " \
-                          "Please check your internet connection or if the device code " \
-                          "exists on GitHub. If the problem still exists please " \
-                          "place the file manually in the proper directory.")
-            return
-
-    with open(device_json_path) as j:
-        try:
-            device_data = json.load(j)
-        except Exception:
-            _LOGGER.error("The device Json file is invalid")
-            return
+    device_data = await DEVICE_DATA.async_acquire(hass, *device_source('climate', config))
+    if device_data is None:
+        return
 
     async_add_entities([SmartIRClimate(
         hass, config, device_data
@@ -165,6 +136,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
+        self._device_source = device_source('climate', config)
         controller = config.get(CONF_CONTROLLER)
         self._controller_type = config.get(CONF_CONTROLLER_TYPE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
@@ -190,6 +162,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._cold_comfort_temperature = config.get(CONF_COLD_COMFORT_TEMPERATURE)
         self._attr_target_temperature_step = config.get(ATTR_TARGET_TEMP_STEP)
         self._attr_precision = config.get(CONF_PRECISION)
+        self._send_debounce = config.get(CONF_SEND_DEBOUNCE)
 
         self._manufacturer = device_data['manufacturer']
         self._supported_models = device_data['supportedModels']
@@ -248,6 +221,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             self._support_swing = True
 
         self._temp_lock = asyncio.Lock()
+        self._cancel_pending_send = None
         self._on_by_remote = False
         self._power_on_time = 0
         self._powering = None
@@ -330,6 +304,12 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         else:
             self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, _async_startup)
 
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed from hass."""
+        await super().async_will_remove_from_hass()
+        self._cancel_pending()
+        DEVICE_DATA.release(*self._device_source)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -539,7 +519,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
             return
 
         if not self._hvac_mode.lower() == HVAC_MODE_OFF:
-            await self.send_command()
+            await self.async_send_state()
 
         await self.async_update_ha_state()
 
@@ -618,7 +598,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._attr_fan_mode = fan_mode
 
         if not self._hvac_mode.lower() == HVAC_MODE_OFF:
-            await self.send_command()
+            await self.async_send_state()
         await self.async_update_ha_state()
 
     async def async_set_swing_mode(self, swing_mode):
@@ -626,7 +606,7 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         self._attr_swing_mode = swing_mode
 
         if not self._hvac_mode.lower() == HVAC_MODE_OFF:
-            await self.send_command()
+            await self.async_send_state()
         await self.async_update_ha_state()
 
     async def async_turn_off(self):
@@ -640,8 +620,33 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
         else:
             await self.async_set_hvac_mode(self._operation_modes[1])
 
+    def _cancel_pending(self):
+        if self._cancel_pending_send is not None:
+            self._cancel_pending_send()
+            self._cancel_pending_send = None
+
+    async def async_send_state(self):
+        """Send the current state.
+
+        With `send_debounce` set, the send is postponed until no other
+        change was made for that many seconds, so a burst of temperature,
+        fan and swing changes is sent as one frame of the final state.
+        """
+        if not self._send_debounce:
+            await self.send_command()
+            return
+
+        self._cancel_pending()
+
+        async def _send_cb(*_):
+            self._cancel_pending_send = None
+            await self.send_command()
+        self._cancel_pending_send = async_call_later(self.hass, self._send_debounce, _send_cb)
+
     async def send_command(self):
-        async with self._temp_lock:
+        # the state sent now includes every pending change
+        self._cancel_pending()
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
             try:
                 self._on_by_remote = False
                 operation_mode = self._hvac_mode
@@ -654,16 +659,16 @@ class SmartIRClimate(ClimateEntity, RestoreEntity):
                     await self._controller.send(self._commands['off'], self)
                     return
 
-                if 'on' in self._commands:
-                    await self._controller.send(self._commands['on'], self)
-                    await asyncio.sleep(self._delay)
-
                 if self._support_swing == True:
-                    await self._controller.send(
-                        self._commands[operation_mode][fan_mode][swing_mode][target_temperature], self)
+                    command = self._commands[operation_mode][fan_mode][swing_mode][target_temperature]
+                else:
+                    command = self._commands[operation_mode][fan_mode][target_temperature]
+
+                if 'on' in self._commands:
+                    await self._controller.send_sequence(
+                        [(self._commands['on'], self._delay), (command, 0)], self)
                 else:
-                    await self._controller.send(
-                        self._commands[operation_mode][fan_mode][target_temperature], self)
+                    await self._controller.send(command, self)
 
             except Exception as e:
                 _LOGGER.exception(e)
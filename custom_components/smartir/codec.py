@@ -0,0 +1,295 @@
+"""Pulse conversions between Pronto, lirc and Broadlink frames.
+
+Each conversion works on a whole frame at once, and the `*_many` variants
+convert a batch of frames in one call. NumPy is used when it is installed;
+otherwise a pure Python implementation produces the same output.
+"""
+import math
+import struct
+
+from itsdangerous import base64_decode
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Broadlink stores pulse lengths in units of 2^-15 s (8192 / 269 µs).
+BROADLINK_IR = 0x26
+BROADLINK_TRAILER = b'\x0d\x05'
+
+
+def _pronto_words(pronto):
+    even = len(pronto) & ~1
+    codes = list(struct.unpack('>{}H'.format(even // 2), bytes(pronto[:even])))
+    if even != len(pronto):
+        codes.append(pronto[-1])
+    return codes
+
+
+def pronto2lirc(pronto):
+    """Convert a Pronto frame (bytes) to a list of lirc pulses in µs."""
+    codes = _pronto_words(pronto)
+
+    if codes[0]:
+        raise ValueError("Pronto code should start with 0000")
+    if len(codes) != 4 + 2 * (codes[2] + codes[3]):
+        raise ValueError("Number of pulse widths does not match the preamble")
+
+    frequency = 1 / (codes[1] * 0.241246)
+    if np is not None:
+        pulses = np.array(codes[4:], dtype=np.int64) / frequency
+        return np.round(pulses).astype(np.int64).tolist()
+    return [int(round(code / frequency)) for code in codes[4:]]
+
+
+def pronto2lirc_many(frames):
+    return [pronto2lirc(pronto) for pronto in frames]
+
+
+def _packet(array):
+    packet = bytearray([BROADLINK_IR, 0x00])
+    packet += struct.pack('<H', len(array))
+    packet += array
+    packet += BROADLINK_TRAILER
+
+    # Add 0s to make ultimate packet size a multiple of 16 for 128-bit AES encryption.
+    remainder = (len(packet) + 4) % 16
+    if remainder:
+        packet += bytearray(16 - remainder)
+    return packet
+
+
+def _encode_pulses(pulses):
+    array = bytearray()
+    for pulse in pulses:
+        pulse = int(pulse * 269 / 8192)
+
+        if 0 <= pulse < 256:
+            array.append(pulse)
+        elif 256 <= pulse <= 0xffff:
+            array += bytes((0x00, pulse >> 8, pulse & 0xff))
+        # Out of range pulses fail with the errors of struct.pack like they always did.
+        elif pulse < 0:
+            raise struct.error("ubyte format requires 0 <= number <= 255")
+        else:
+            array.append(0x00)
+            array += struct.pack('>H', pulse)
+    return array
+
+
+def _encode_pulses_np(flat):
+    """Encode the pulses of any number of frames; returns the bytes and the
+    encoded size of every pulse."""
+    units = np.trunc(np.asarray(flat, dtype=np.float64) * 269 / 8192).astype(np.int64)
+    if units.size and (units.min() < 0 or units.max() > 0xffff):
+        return None, None
+
+    big = units >= 256
+    sizes = 1 + 2 * big
+    starts = np.cumsum(sizes) - sizes
+    array = np.zeros(int(sizes.sum()), dtype=np.uint8)
+
+    small = ~big
+    array[starts[small]] = units[small]
+    array[starts[big] + 1] = units[big] >> 8
+    array[starts[big] + 2] = units[big] & 0xff
+    return array, sizes
+
+
+def lirc2broadlink(pulses):
+    """Convert lirc pulses in µs to a Broadlink IR packet."""
+    return lirc2broadlink_many([pulses])[0]
+
+
+def lirc2broadlink_many(frames):
+    """Convert several frames of lirc pulses to Broadlink IR packets."""
+    frames = [list(pulses) for pulses in frames]
+    if np is not None:
+        flat = [pulse for pulses in frames for pulse in pulses]
+        array, sizes = _encode_pulses_np(flat)
+        if array is not None:
+            ends = np.cumsum(sizes).tolist()
+            data = array.tobytes()
+            packets = []
+            index = 0
+            offset = 0
+            for pulses in frames:
+                index += len(pulses)
+                end = ends[index - 1] if index else 0
+                packets.append(_packet(data[offset:end]))
+                offset = end
+            return packets
+    # Out of range pulses fail in the pure Python encoder like they always did.
+    return [_packet(_encode_pulses(pulses)) for pulses in frames]
+
+
+def _broadlink_bytes(command):
+    pulses = base64_decode(command) if type(command) is str else command
+    if pulses[0] != BROADLINK_IR:
+        raise Exception("This broadlink data is not IR data")
+    return pulses
+
+
+def _broadlink_units(pulses):
+    """Return the pulse lengths of a Broadlink packet in Broadlink units.
+
+    Skips the type, repeat and length header; a 0x00 byte marks a big
+    endian 16 bit length. Stops after a 16 bit length whose low byte starts
+    a 0x00 0x0d 0x05 sequence, like the original conversion did.
+    """
+    units = []
+    ix = 4
+    size = len(pulses)
+    while ix < size:
+        current = pulses[ix]
+        if current:
+            units.append(current)
+            ix += 1
+            continue
+
+        if ix + 3 > size:
+            raise struct.error("unpack requires a buffer of 2 bytes")
+        current = (pulses[ix + 1] << 8) | pulses[ix + 2]
+        units.append(current)
+        if pulses[ix + 2:ix + 5] == b'\x00\x0d\x05':
+            break
+        ix += 3
+    return units
+
+
+def _broadlink_units_np(pulses):
+    data = np.frombuffer(bytes(pulses), dtype=np.uint8)
+    size = len(data)
+    values = data.astype(np.int64)
+    starts = np.ones(size, dtype=bool)
+    starts[:4] = False
+
+    # Only the 0x00 markers need to be walked one by one, all other bytes
+    # are one pulse each.
+    covered = 4
+    for ix in (np.flatnonzero(data[4:] == 0) + 4).tolist():
+        if ix < covered:
+            continue
+        if ix + 3 > size:
+            raise struct.error("unpack requires a buffer of 2 bytes")
+        values[ix] = (int(data[ix + 1]) << 8) | int(data[ix + 2])
+        starts[ix + 1:ix + 3] = False
+        covered = ix + 3
+        if ix + 5 <= size and data[ix + 2] == 0 and data[ix + 3] == 0x0d \
+                and data[ix + 4] == 0x05:
+            starts[ix + 3:] = False
+            break
+    return values[starts]
+
+
+def broadlink2lirc(command):
+    """Convert a Broadlink IR packet (base64 or bytes) to lirc pulses in µs."""
+    return broadlink2lirc_many([command])[0]
+
+
+def broadlink2lirc_many(commands):
+    """Convert several Broadlink IR packets to lists of lirc pulses."""
+    frames = [_broadlink_bytes(command) for command in commands]
+    if np is not None:
+        units = [_broadlink_units_np(pulses) for pulses in frames]
+        lengths = [len(u) for u in units]
+        # Reverse the formula: µs * 2^-15
+        flat = np.floor(np.concatenate(units) / 269 * 8192).astype(np.int64).tolist() \
+            if units else []
+        result = []
+        offset = 0
+        for length in lengths:
+            result.append(flat[offset:offset + length])
+            offset += length
+        return result
+
+    return [[math.floor(unit / 269 * 8192) for unit in _broadlink_units(pulses)]
+            for pulses in frames]
+
+
+def _payload_units(pulses):
+    """Return the pulse lengths inside the declared length of a Broadlink packet."""
+    size = min(4 + (pulses[2] | (pulses[3] << 8)), len(pulses))
+    units = []
+    ix = 4
+    while ix < size:
+        current = pulses[ix]
+        if current:
+            units.append(current)
+            ix += 1
+        elif ix + 3 > len(pulses):
+            # a 16 bit length cut off by the end of the packet
+            break
+        else:
+            units.append((pulses[ix + 1] << 8) | pulses[ix + 2])
+            ix += 3
+    return units
+
+
+def broadlink_payload2lirc(command):
+    """Convert the pulses inside the declared length of a Broadlink IR packet
+    to lirc pulses, whatever trailer or padding follows them."""
+    return [math.floor(unit / 269 * 8192)
+            for unit in _payload_units(_broadlink_bytes(command))]
+
+
+def fuse_broadlink(commands, gaps):
+    """Fuse Broadlink IR packets into one packet.
+
+    `gaps` holds the seconds of silence after each packet but the last.
+    The repeats of every packet are unrolled, and a gap lengthens the
+    trailing space of its packet. Raises ValueError when a gap or the
+    fused packet doesn't fit in the Broadlink format.
+    """
+    units = []
+    for index, command in enumerate(commands):
+        pulses = _broadlink_bytes(command)
+        units += _payload_units(pulses) * (pulses[1] + 1)
+        if index == len(commands) - 1:
+            break
+        gap = int(gaps[index] * 1000000 * 269 / 8192)
+        if gap > 0xffff:
+            raise ValueError("A gap of {}s is too long for a Broadlink packet".format(gaps[index]))
+        if len(units) % 2:
+            units.append(gap)
+        elif units[-1] < gap:
+            units[-1] = gap
+
+    array = _encode_units(units)
+    if len(array) > 0xffff:
+        raise ValueError("The fused Broadlink packet is too long")
+    return _packet(array)
+
+
+def _encode_units(units):
+    array = bytearray()
+    for unit in units:
+        if 0 < unit < 256:
+            array.append(unit)
+        else:
+            array += bytes((0x00, unit >> 8, unit & 0xff))
+    return array
+
+
+def repeat_broadlink(command, times, gap):
+    """Return the Broadlink packets sending a packet `times` times.
+
+    Uses the repeat byte of the packet, so up to 256 sends fit in one
+    packet. A packet ending with a pulse instead of a space gets a
+    trailing space of `gap` seconds, so that the repeats stay apart.
+    """
+    packet = bytearray(_broadlink_bytes(command))
+    sends = (packet[1] + 1) * times
+    units = _payload_units(packet)
+    if len(units) % 2:
+        units.append(min(int(gap * 1000000 * 269 / 8192), 0xffff))
+        packet = _packet(_encode_units(units))
+
+    packets = []
+    while sends > 0:
+        count = min(sends, 256)
+        packet[1] = count - 1
+        packets.append(bytes(packet))
+        sends -= count
+    return packets
@@ -0,0 +1,258 @@
+"""Compiled, memory-mappable code packs.
+
+A code pack holds the same data as a device Json file, laid out so that it
+can be memory-mapped and read lazily:
+
+    header | meta (Json, everything but `commands`) | index | keys | blobs
+
+The index is a table of fixed size entries sorted by key, each pointing to
+the key string and to the Json encoded command blob. Every distinct blob is
+stored once, entries of identical commands point to the same blob. Opening
+a pack only reads the header, meta and index; a command blob is read from
+the mapping when the command is looked up for the first time.
+
+Build packs from the shipped Json files with:
+
+    python -m custom_components.smartir.codepack codes/climate
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+from .commands import CommandNode, LeafRef, COMMAND_STORE, is_command
+
+PACK_MAGIC = b'SIRPACK\x00'
+PACK_VERSION = 1
+PACK_EXTENSION = '.pack'
+
+KEY_SEPARATOR = '\x1f'
+
+# magic, version, codec version, meta offset, meta length, index offset, index count,
+# blob offset. The codec version is the one of the controllers which transcoded the
+# commands of a variant pack, 0 in packs holding the commands of the Json file.
+HEADER = struct.Struct('<8sHHIIIII')
+# key offset, key length, blob offset, blob length
+INDEX_ENTRY = struct.Struct('<IHII')
+
+
+class CodePackError(Exception):
+    """The code pack is malformed or was built by an unsupported version."""
+
+
+def pack_variant(controller, controller_type=None):
+    """Return the name of the pack variant precompiled for a controller."""
+    if not controller:
+        return None
+    if controller_type:
+        return '{}-{}'.format(controller, controller_type)
+    return controller
+
+
+def pack_path_for(json_path, variant=None):
+    """Return the code pack path belonging to a device Json file.
+
+    A variant pack holds the commands already transcoded for the
+    controller named by `variant`, see `compiler.py`.
+    """
+    base = os.path.splitext(json_path)[0]
+    if variant:
+        base += '.' + variant
+    return base + PACK_EXTENSION
+
+
+def read_codec_version(pack_path):
+    """Return the codec version recorded in the header of a code pack."""
+    with open(pack_path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise CodePackError("{} is too short".format(pack_path))
+    return HEADER.unpack(header)[2]
+
+
+def is_fresh(json_path, variant=None, codec_version=None):
+    """Whether a code pack exists and is not older than its Json file.
+
+    A variant pack is stale as well when its commands were transcoded by
+    another codec version than `codec_version`.
+    """
+    pack_path = pack_path_for(json_path, variant)
+    if not os.path.exists(pack_path):
+        return False
+    if variant and codec_version is not None:
+        try:
+            if read_codec_version(pack_path) != codec_version:
+                return False
+        except (OSError, CodePackError):
+            return False
+    if not os.path.exists(json_path):
+        return True
+    return os.path.getmtime(pack_path) >= os.path.getmtime(json_path)
+
+
+def _flatten(node, path, leaves):
+    for key, value in node.items():
+        if type(value) is dict and value and not is_command(value):
+            _flatten(value, path + (str(key),), leaves)
+        else:
+            leaves.append((path + (str(key),), value))
+
+
+def build_pack(device_data, codec_version=0):
+    """Compile device data into the bytes of a code pack.
+
+    `codec_version` is the codec version of the controllers which
+    transcoded the commands of a variant pack.
+    """
+    meta = {k: v for k, v in device_data.items() if k != 'commands'}
+    meta = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+    leaves = []
+    _flatten(device_data.get('commands', {}), (), leaves)
+    leaves.sort(key=lambda leaf: leaf[0])
+
+    keys = bytearray()
+    blobs = bytearray()
+    blob_offsets = {}
+    entries = []
+    for path, value in leaves:
+        key = KEY_SEPARATOR.join(path).encode('utf-8')
+        blob = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        offset = blob_offsets.get(blob)
+        if offset is None:
+            offset = blob_offsets[blob] = len(blobs)
+            blobs += blob
+        entries.append((len(keys), len(key), offset, len(blob)))
+        keys += key
+
+    meta_offset = HEADER.size
+    index_offset = meta_offset + len(meta)
+    keys_offset = index_offset + INDEX_ENTRY.size * len(entries)
+    blob_offset = keys_offset + len(keys)
+
+    packet = bytearray(HEADER.pack(
+        PACK_MAGIC, PACK_VERSION, codec_version,
+        meta_offset, len(meta), index_offset, len(entries), blob_offset))
+    packet += meta
+    for key_offset, key_length, offset, length in entries:
+        packet += INDEX_ENTRY.pack(
+            keys_offset + key_offset, key_length, blob_offset + offset, length)
+    packet += keys
+    packet += blobs
+    return bytes(packet)
+
+
+def compile_file(json_path, pack_path=None):
+    """Build the code pack for a device Json file and return its path."""
+    pack_path = pack_path or pack_path_for(json_path)
+
+    with open(json_path) as j:
+        device_data = json.load(j)
+
+    tmp_path = pack_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(build_pack(device_data))
+    os.replace(tmp_path, pack_path)
+    return pack_path
+
+
+class CodePack():
+    """A memory-mapped code pack."""
+
+    def __init__(self, path):
+        self.path = path
+        # blob offset -> decoded command, shared by the entries of identical commands
+        self._leaves = {}
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.device_data = self._read_index()
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def load(cls, json_path, variant=None):
+        """Open the code pack belonging to a device Json file."""
+        return cls(pack_path_for(json_path, variant))
+
+    def _read_index(self):
+        buf = self._mmap
+        if len(buf) < HEADER.size:
+            raise CodePackError("{} is too short".format(self.path))
+
+        (magic, version, _codec_version, meta_offset, meta_length,
+            index_offset, index_count, _blob_offset) = HEADER.unpack_from(buf, 0)
+        if magic != PACK_MAGIC:
+            raise CodePackError("{} is not a code pack".format(self.path))
+        if version != PACK_VERSION:
+            raise CodePackError("{} has unsupported version {}".format(self.path, version))
+
+        device_data = json.loads(buf[meta_offset:meta_offset + meta_length])
+        commands = {}
+        refs = {}
+        index = buf[index_offset:index_offset + index_count * INDEX_ENTRY.size]
+        for key_offset, key_length, offset, length in INDEX_ENTRY.iter_unpack(index):
+            path = buf[key_offset:key_offset + key_length].decode('utf-8')
+            path = path.split(KEY_SEPARATOR)
+
+            node = commands
+            for name in path[:-1]:
+                node = node.setdefault(name, {})
+            ref = refs.get(offset)
+            if ref is None:
+                ref = refs[offset] = LeafRef(offset, length)
+            node[path[-1]] = ref
+
+        device_data['commands'] = CommandNode(self, commands)
+        return device_data
+
+    def read_leaf(self, ref):
+        """Decode one command blob."""
+        value = self._leaves.get(ref.offset)
+        if value is None:
+            value = COMMAND_STORE.intern(
+                json.loads(self._mmap[ref.offset:ref.offset + ref.length]))
+            self._leaves[ref.offset] = value
+        return value
+
+    def close(self):
+        for value in self._leaves.values():
+            COMMAND_STORE.release(value)
+        self._leaves = {}
+        self._mmap.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile SmartIR device Json files into code packs.")
+    parser.add_argument('paths', nargs='+',
+                        help="device Json files or directories containing them")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for path in args.paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                           if name.endswith('.json'))
+        else:
+            files = [path]
+
+        for json_path in files:
+            try:
+                pack_path = compile_file(json_path)
+            except Exception as e:
+                failed = True
+                print("{}: {}".format(json_path, e), file=sys.stderr)
+                continue
+            print("{}: {} -> {} bytes".format(
+                pack_path, os.path.getsize(json_path), os.path.getsize(pack_path)))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
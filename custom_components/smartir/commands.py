@@ -0,0 +1,413 @@
+import asyncio
+from collections.abc import Mapping
+from json.decoder import scanstring
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+
+# keys of commands which are Json objects, such as the OpenMQTTGateway
+# {"protocol_name": "Raw", "raw": "..."}, and not levels of the command tree
+COMMAND_KEYS = frozenset(('protocol_name', 'raw', 'Raw'))
+
+
+def is_command(value):
+    """Whether a Json object is a command rather than a level of the tree."""
+    return type(value) is dict and not COMMAND_KEYS.isdisjoint(value)
+
+
+# seconds between two checks whether a device Json file changed
+CHANGE_CHECK_INTERVAL = 5
+
+
+class SourceChanged(Exception):
+    """The command source was re-indexed, its references are outdated."""
+
+
+class LeafRef():
+    """Location of a not yet decoded command inside a command source."""
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return 'LeafRef({}, {})'.format(self.offset, self.length)
+
+
+class CommandNode(Mapping):
+    """Read-only view on one level of a device's command tree.
+
+    The tree is a skeleton of plain dicts whose leaves are `LeafRef`s.
+    A leaf is read through `source.read_leaf(ref)`, which decodes it the
+    first time it is looked up and keeps it, so only the commands which are
+    actually sent are ever held in memory. A decoded command may be a dict
+    too, it is returned as is.
+    """
+    __slots__ = ('_source', '_children')
+
+    def __init__(self, source, children):
+        self._source = source
+        self._children = children
+
+    def __getitem__(self, key):
+        value = self._children[key]
+        if type(value) is LeafRef:
+            try:
+                return self._source.read_leaf(value)
+            except SourceChanged:
+                # the skeleton was updated in place, look the key up again
+                return self[key]
+        if type(value) is dict:
+            return CommandNode(self._source, value)
+        return value
+
+    def __contains__(self, key):
+        return key in self._children
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def __len__(self):
+        return len(self._children)
+
+    def __repr__(self):
+        return '<CommandNode {}>'.format(list(self._children))
+
+    def close(self):
+        """Release the commands read and close the source of the tree."""
+        self._source.close()
+
+
+class CommandStore():
+    """Process-wide content-addressed store of decoded commands.
+
+    Many device files share whole protocols, so the same command is often
+    read from several files. Interning returns the one string object which
+    already holds a command's content, and every command tree refers to it
+    instead of keeping a copy. The store counts the references it handed
+    out and drops a command once every source holding it released it.
+    """
+
+    def __init__(self):
+        # command -> [shared string, references]
+        self._commands = {}
+        self.lookups = 0
+        self.shared = 0
+        self.shared_bytes = 0
+
+    def intern(self, command):
+        if type(command) is not str:
+            return command
+        self.lookups += 1
+        entry = self._commands.get(command)
+        if entry is None:
+            self._commands[command] = [command, 1]
+            return command
+        entry[1] += 1
+        self.shared += 1
+        self.shared_bytes += len(command)
+        return entry[0]
+
+    def release(self, command):
+        """Drop a reference returned by `intern`."""
+        if type(command) is not str:
+            return
+        entry = self._commands.get(command)
+        if entry is None or entry[0] is not command:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._commands[command]
+
+    def stats(self):
+        return {
+            'commands': len(self._commands),
+            'lookups': self.lookups,
+            'shared': self.shared,
+            'shared_bytes': self.shared_bytes,
+        }
+
+
+COMMAND_STORE = CommandStore()
+
+
+def _sizeof(value):
+    size = sys.getsizeof(value)
+    if type(value) in (list, tuple):
+        size += sum(_sizeof(item) for item in value)
+    elif type(value) is dict:
+        size += sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    return size
+
+
+def resident_bytes(node, seen=None):
+    """Return the memory held by the decoded commands of a command tree.
+
+    Commands which weren't read yet aren't counted, and a command shared
+    with a tree already counted with the same `seen` set is counted once.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    for value in list(node._source._leaves.values()):
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        total += _sizeof(value)
+    return total
+
+
+class CommandOverlay(Mapping):
+    """Per-entity view on a shared command mapping with renamed keys.
+
+    `renames` maps a key of `base` to its new name, or to None to hide it.
+    Renamed keys are listed after the untouched ones, in `renames` order.
+    """
+    __slots__ = ('_base', '_names')
+
+    def __init__(self, base, renames):
+        self._base = base
+        self._names = {key: key for key in base if key not in renames}
+        for key, new_name in renames.items():
+            if key in base and new_name is not None:
+                self._names[new_name] = key
+
+    def __getitem__(self, key):
+        return self._base[self._names[key]]
+
+    def __contains__(self, key):
+        return key in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+class JsonCommandSource():
+    """A device Json file whose commands are read on demand.
+
+    Opening the file scans it once and records the byte range of every leaf
+    of the command tree; the other device fields are decoded right away.
+    Identical commands share the byte range of their first occurrence.
+    The file is memory-mapped and a command is decoded from the mapping the
+    first time it is looked up, looking a command up never reads the file.
+
+    When the file changes, e.g. after an update replaced it, the commands
+    are indexed again and the tree handed out is updated in place. On the
+    event loop the file is checked and indexed again in the executor, the
+    commands of the mapped file are used until then.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # blob offset -> decoded command
+        self._leaves = {}
+        self._root = {}
+        self._mmap = None
+        self._reload = None
+        self._closed = False
+        self.device_data = self._apply(*self._read())
+
+    def _read(self):
+        """Map and index the file; returns the device data, the mapping and
+        the identity of the file. Blocking, leaves the loaded commands alone."""
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            raw = mapping[:]
+            # latin-1 maps every byte to one character, so that string
+            # indexes are byte offsets into the file.
+            device_data = self._parse(raw, raw.decode('latin-1'))
+        except Exception:
+            mapping.close()
+            raise
+        return device_data, mapping, (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _read_changed(self, known):
+        """Read the file again when its identity isn't `known` anymore;
+        returns what `_read` does, or None. Blocking."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # removed, the mapping still holds the file loaded
+            return None
+        stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stat == known:
+            return None
+
+        _LOGGER.info("%s changed, reading its commands again", self.path)
+        try:
+            return self._read()
+        except Exception as e:
+            _LOGGER.warning("Unable to read %s again, keeping the commands "
+                            "loaded before: %s", self.path, e)
+            # keep them until the file changes again
+            return None, None, stat
+
+    def _apply(self, device_data, mapping, stat):
+        """Hand out the commands of the file read by `_read`."""
+        self._stat = stat
+        self._checked = time.monotonic()
+        if mapping is None:
+            return None
+
+        commands = device_data.get('commands')
+        if type(commands) is dict:
+            _update_tree(self._root, commands)
+            device_data['commands'] = CommandNode(self, self._root)
+        self._release()
+        self._mmap = mapping
+        return device_data
+
+    def _check(self):
+        """Index the file again if it changed.
+
+        Raises SourceChanged when it was indexed right away, which is only
+        done outside of the event loop.
+        """
+        self._checked = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            result = self._read_changed(self._stat)
+            if result is not None and self._apply(*result) is not None:
+                raise SourceChanged(self.path)
+            return
+        if self._reload is None:
+            self._reload = loop.create_task(self._async_reload(loop))
+
+    async def _async_reload(self, loop):
+        try:
+            result = await loop.run_in_executor(None, self._read_changed, self._stat)
+        finally:
+            self._reload = None
+        if result is None:
+            return
+        if self._closed:
+            if result[1] is not None:
+                result[1].close()
+            return
+        self._apply(*result)
+
+    def _parse(self, raw, text):
+        device_data = {}
+        idx = self._expect(text, _WHITESPACE.match(text, 0).end(), '{')
+        idx = _WHITESPACE.match(text, idx).end()
+        if text[idx] == '}':
+            return device_data
+
+        while True:
+            key, idx = self._key(text, idx)
+            if key == 'commands' and text[idx] == '{':
+                value, idx = self._index(text, idx, {})
+            else:
+                start = idx
+                idx = _DECODER.raw_decode(text, idx)[1]
+                value = json.loads(raw[start:idx])
+            device_data[key] = value
+
+            idx = _WHITESPACE.match(text, idx).end()
+            if text[idx] == '}':
+                return device_data
+            idx = self._expect(text, idx, ',')
+            idx = _WHITESPACE.match(text, idx).end()
+
+    def _index(self, text, idx, refs):
+        children = {}
+        idx = _WHITESPACE.match(text, idx + 1).end()
+        if text[idx] == '}':
+            return children, idx + 1
+
+        while True:
+            key, idx = self._key(text, idx)
+            start = idx
+            if text[idx] == '{':
+                child, idx = self._index(text, idx, refs)
+                if is_command(child):
+                    child = self._ref(text, start, idx, refs)
+                children[key] = child
+            else:
+                if text[idx] == '"':
+                    idx = scanstring(text, idx + 1)[1]
+                else:
+                    idx = _DECODER.raw_decode(text, idx)[1]
+                children[key] = self._ref(text, start, idx, refs)
+
+            idx = _WHITESPACE.match(text, idx).end()
+            if text[idx] == '}':
+                return children, idx + 1
+            idx = self._expect(text, idx, ',')
+            idx = _WHITESPACE.match(text, idx).end()
+
+    def _ref(self, text, start, end, refs):
+        blob = text[start:end]
+        ref = refs.get(blob)
+        if ref is None:
+            ref = refs[blob] = LeafRef(start, end - start)
+        return ref
+
+    def _key(self, text, idx):
+        idx = self._expect(text, idx, '"')
+        key, idx = scanstring(text, idx)
+        idx = _WHITESPACE.match(text, idx).end()
+        idx = self._expect(text, idx, ':')
+        idx = _WHITESPACE.match(text, idx).end()
+        return key.encode('latin-1').decode('utf-8'), idx
+
+    def _expect(self, text, idx, char):
+        if text[idx:idx + 1] != char:
+            raise json.JSONDecodeError("Expecting '{}'".format(char), text, idx)
+        return idx + 1
+
+    def read_leaf(self, ref):
+        """Decode one command from the mapped file.
+
+        Raises SourceChanged when the file changed and was indexed again
+        right away, see `_check`.
+        """
+        if time.monotonic() - self._checked > CHANGE_CHECK_INTERVAL:
+            self._check()
+        value = self._leaves.get(ref.offset)
+        if value is None:
+            value = COMMAND_STORE.intern(
+                json.loads(self._mmap[ref.offset:ref.offset + ref.length]))
+            self._leaves[ref.offset] = value
+        return value
+
+    def _release(self):
+        for value in self._leaves.values():
+            COMMAND_STORE.release(value)
+        self._leaves = {}
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def close(self):
+        self._closed = True
+        self._release()
+
+
+def _update_tree(tree, update):
+    """Make a command tree skeleton equal to another one, in place, so that
+    the views on its levels see the new references."""
+    for key in [key for key in tree if key not in update]:
+        del tree[key]
+    for key, value in update.items():
+        current = tree.get(key)
+        if type(current) is dict and type(value) is dict:
+            _update_tree(current, value)
+        else:
+            tree[key] = value
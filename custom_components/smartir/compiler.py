@@ -0,0 +1,392 @@
+"""Validate and precompile the device code library.
+
+    python -m custom_components.smartir.compiler custom_components/smartir/codes
+
+Every device Json file under the codes directory is parsed and checked
+against the fields and command tree shape the climate, fan and media
+player entities expect. Missing fields are errors, gaps in the command
+tree are reported as warnings. Valid files are compiled into a code pack and into
+one variant pack per target controller which holds the commands already
+transcoded for that controller. The report lists file and pack sizes,
+duplicated codes, the bytes saved by storing them once and transcoding
+failures.
+"""
+import argparse
+from collections import defaultdict
+import hashlib
+import json
+import os
+import sys
+
+from . import codepack
+from .commands import is_command
+from .controllers import (
+    AbstractController,
+    ENC_BASE64, ENC_HEX, ENC_PRONTO, ENC_RAW,
+    BROADLINK_CONTROLLER, MQTT_CONTROLLER, ESPHOME_CONTROLLER,
+    CODEC_VERSION,
+    get_controller,
+)
+
+PLATFORMS = ['climate', 'fan', 'media_player']
+ENCODINGS = [ENC_BASE64, ENC_HEX, ENC_PRONTO, ENC_RAW]
+
+# (controller, controller_type, encoding of the transcoded commands)
+TARGETS = [
+    (BROADLINK_CONTROLLER, None, ENC_BASE64),
+    (MQTT_CONTROLLER, None, ENC_RAW),
+    (MQTT_CONTROLLER, 'IRremoteESP8266', ENC_RAW),
+    (ESPHOME_CONTROLLER, None, ENC_RAW),
+]
+
+COMMON_FIELDS = {
+    'manufacturer': str,
+    'supportedModels': list,
+    'supportedController': str,
+    'commandsEncoding': str,
+    'commands': dict,
+}
+PLATFORM_FIELDS = {
+    'climate': {
+        'minTemperature': (int, float),
+        'maxTemperature': (int, float),
+        'precision': (int, float),
+        'operationModes': list,
+        'fanModes': list,
+    },
+    'fan': {
+        'speed': list,
+    },
+    'media_player': {},
+}
+
+
+class _CodeFile():
+    """Stands in for an entity when transcoding a code file."""
+
+    def __init__(self, device_data, controller, controller_type):
+        self._supported_controller = device_data['supportedController']
+        self._supported_controller_type = device_data.get('controllerType')
+        self._commands_encoding = device_data['commandsEncoding']
+        self._controller_type = controller_type
+        self._controller_data = None
+        self._delay = 0
+
+
+class FileReport():
+    def __init__(self, platform, path):
+        self.platform = platform
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.errors = []
+        self.warnings = []
+        self.packs = {}
+        self.failures = {}
+        self.leaves = 0
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+
+    def as_dict(self):
+        return {
+            'platform': self.platform,
+            'path': self.path,
+            'size': self.size,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'packs': self.packs,
+            'transcoding_failures': self.failures,
+            'commands': self.leaves,
+            'duplicate_commands': self.duplicates,
+            'duplicate_bytes': self.duplicate_bytes,
+        }
+
+
+def iter_leaves(node, path=()):
+    """Yield (path, command) for every command of a command tree."""
+    for key, value in node.items():
+        if type(value) is dict and not is_command(value):
+            yield from iter_leaves(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+
+def map_leaves(node, func):
+    return {key: map_leaves(value, func)
+            if type(value) is dict and not is_command(value) else func(value)
+            for key, value in node.items()}
+
+
+def _climate_temperatures(device_data):
+    low = device_data['minTemperature']
+    high = device_data['maxTemperature']
+    step = device_data['precision']
+    if step <= 0:
+        return []
+
+    temperatures = []
+    i = 0
+    while round(low + i * step, 1) <= high:
+        temperatures.append('{0:g}'.format(round(low + i * step, 1)))
+        i += 1
+    return temperatures
+
+
+def _validate_climate(device_data, report):
+    commands = device_data['commands']
+    swing_modes = device_data.get('swingModes')
+    temperatures = _climate_temperatures(device_data)
+
+    if 'off' not in commands:
+        report.errors.append("missing the 'off' command")
+
+    for mode in device_data['operationModes']:
+        fans = commands.get(mode)
+        if type(fans) is not dict:
+            report.warnings.append("missing commands for operation mode '{}'".format(mode))
+            continue
+        for fan in device_data['fanModes']:
+            node = fans.get(fan)
+            if type(node) is not dict:
+                report.warnings.append("missing commands for '{}/{}'".format(mode, fan))
+                continue
+
+            levels = {}
+            if swing_modes:
+                for swing in swing_modes:
+                    if type(node.get(swing)) is not dict:
+                        report.warnings.append("missing commands for '{}/{}/{}'".format(
+                            mode, fan, swing))
+                        continue
+                    levels['{}/{}/{}'.format(mode, fan, swing)] = node[swing]
+            else:
+                levels['{}/{}'.format(mode, fan)] = node
+
+            for path, node in levels.items():
+                missing = [t for t in temperatures if t not in node]
+                if missing:
+                    report.warnings.append("'{}' has no commands for temperatures {}".format(
+                        path, ', '.join(missing)))
+
+
+def _validate_fan(device_data, report):
+    commands = device_data['commands']
+
+    if 'off' not in commands:
+        report.errors.append("missing the 'off' command")
+
+    directions = [d for d in ('default', 'forward', 'reverse') if d in commands]
+    if not directions:
+        report.warnings.append("missing speed commands ('default', 'forward' or 'reverse')")
+
+    for direction in directions:
+        if type(commands[direction]) is not dict:
+            report.warnings.append("'{}' is not a mapping of speeds".format(direction))
+            continue
+        for speed in device_data['speed']:
+            if speed not in commands[direction]:
+                report.warnings.append("missing the '{}/{}' command".format(direction, speed))
+
+
+def _validate_media_player(device_data, report):
+    sources = device_data['commands'].get('sources')
+    if sources is not None and type(sources) is not dict:
+        report.errors.append("'sources' is not a mapping of source names")
+
+
+VALIDATORS = {
+    'climate': _validate_climate,
+    'fan': _validate_fan,
+    'media_player': _validate_media_player,
+}
+
+
+def validate(platform, device_data, report):
+    """Check device data against what the platform's entity expects."""
+    if type(device_data) is not dict:
+        report.errors.append("the device data is not a Json object")
+        return
+
+    fields = dict(COMMON_FIELDS, **PLATFORM_FIELDS[platform])
+    for name, types in fields.items():
+        if name not in device_data:
+            report.errors.append("missing the '{}' field".format(name))
+        elif not isinstance(device_data[name], types):
+            report.errors.append("the '{}' field has the wrong type".format(name))
+    if report.errors:
+        return
+
+    if device_data['supportedController'] not in AbstractController.controllers:
+        report.errors.append("unknown supportedController '{}'".format(
+            device_data['supportedController']))
+    if device_data['commandsEncoding'] not in ENCODINGS:
+        report.errors.append("unknown commandsEncoding '{}'".format(
+            device_data['commandsEncoding']))
+
+    VALIDATORS[platform](device_data, report)
+
+
+def transcode(device_data, controller, controller_type, encoding, report):
+    """Return the device data with every command decoded for a controller,
+    or None when the controller can't send the file's commands."""
+    target = get_controller(controller)
+    data = _CodeFile(device_data, controller, controller_type)
+    variant = codepack.pack_variant(controller, controller_type)
+    failures = []
+
+    def decode(command):
+        if command is None:
+            return None
+        try:
+            return target.decode(command, data)
+        except Exception as e:
+            failures.append(str(e))
+            return None
+
+    commands = map_leaves(device_data['commands'], decode)
+    if failures:
+        report.failures[variant] = {'count': len(failures), 'first': failures[0]}
+        return None
+
+    result = dict(device_data, commands=commands)
+    result['supportedController'] = controller
+    result['commandsEncoding'] = encoding
+    if controller_type:
+        result['controllerType'] = controller_type
+    else:
+        result.pop('controllerType', None)
+    return result
+
+
+def _write_pack(pack_path, device_data, codec_version=0):
+    tmp_path = pack_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(codepack.build_pack(device_data, codec_version))
+    os.replace(tmp_path, pack_path)
+    return os.path.getsize(pack_path)
+
+
+def compile_file(platform, path, frames, write_packs=True):
+    """Validate and compile one device file."""
+    report = FileReport(platform, path)
+    try:
+        with open(path) as j:
+            device_data = json.load(j)
+    except ValueError as e:
+        report.errors.append("invalid Json: {}".format(e))
+        return report
+
+    validate(platform, device_data, report)
+    if report.errors:
+        return report
+
+    seen = set()
+    for _path, command in iter_leaves(device_data['commands']):
+        if command is None:
+            continue
+        report.leaves += 1
+        blob = json.dumps(command, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.blake2b(blob, digest_size=16).digest()
+        if digest in seen:
+            report.duplicates += 1
+            report.duplicate_bytes += len(blob)
+        seen.add(digest)
+        frames[digest, len(blob)].add(path)
+
+    if write_packs:
+        report.packs['native'] = _write_pack(codepack.pack_path_for(path), device_data)
+
+    for controller, controller_type, encoding in TARGETS:
+        if (controller == device_data['supportedController'] and
+                controller_type == device_data.get('controllerType')):
+            continue
+        transcoded = transcode(device_data, controller, controller_type, encoding, report)
+        if transcoded is not None and write_packs:
+            variant = codepack.pack_variant(controller, controller_type)
+            report.packs[variant] = _write_pack(
+                codepack.pack_path_for(path, variant), transcoded, CODEC_VERSION)
+
+    return report
+
+
+def compile_library(codes_dir, write_packs=True):
+    """Validate and compile all device files below a codes directory."""
+    reports = []
+    frames = defaultdict(set)
+    for platform in PLATFORMS:
+        platform_dir = os.path.join(codes_dir, platform)
+        if not os.path.isdir(platform_dir):
+            continue
+        for name in sorted(os.listdir(platform_dir)):
+            if name.endswith('.json'):
+                reports.append(compile_file(
+                    platform, os.path.join(platform_dir, name), frames, write_packs))
+
+    shared = sum(1 for files in frames.values() if len(files) > 1)
+    shared_bytes = sum(size * (len(files) - 1) for (_digest, size), files in frames.items())
+    return reports, {
+        'unique_commands': len(frames),
+        'unique_command_bytes': sum(size for _digest, size in frames),
+        'commands_shared_across_files': shared,
+        'bytes_shared_across_files': shared_bytes,
+    }
+
+
+def _print_report(reports, totals, verbose):
+    invalid = [r for r in reports if r.errors]
+    for report in reports:
+        status = 'INVALID' if report.errors else 'ok'
+        if not verbose and not report.errors and not report.failures:
+            continue
+        print("{} [{}] {} bytes, {} commands, {} duplicated ({} bytes)".format(
+            report.path, status, report.size, report.leaves, report.duplicates,
+            report.duplicate_bytes))
+        for error in report.errors:
+            print("  error: " + error)
+        if verbose:
+            for warning in report.warnings:
+                print("  warning: " + warning)
+        for variant, pack_size in report.packs.items():
+            print("  pack {}: {} bytes".format(variant, pack_size))
+        for variant, failure in report.failures.items():
+            print("  {} transcoding failures for {}: {}".format(
+                failure['count'], variant, failure['first']))
+
+    print()
+    print("{} files, {} invalid, {} with warnings".format(
+        len(reports), len(invalid), len([r for r in reports if r.warnings])))
+    print("{} bytes of Json, {} bytes of native packs".format(
+        sum(r.size for r in reports), sum(r.packs.get('native', 0) for r in reports)))
+    print("{} commands, {} duplicated inside a file, {} unique, "
+          "{} shared by several files".format(
+              sum(r.leaves for r in reports), sum(r.duplicates for r in reports),
+              totals['unique_commands'], totals['commands_shared_across_files']))
+    print("{} bytes saved by storing duplicated commands once per pack, "
+          "{} more bytes shared between files at runtime".format(
+              sum(r.duplicate_bytes for r in reports), totals['bytes_shared_across_files']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Validate and precompile the SmartIR device code library.")
+    parser.add_argument('codes_dir', help="the codes directory")
+    parser.add_argument('--check', action='store_true',
+                        help="only validate, don't write code packs")
+    parser.add_argument('--json', action='store_true',
+                        help="print the report as Json")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="report every file, including warnings")
+    args = parser.parse_args(argv)
+
+    reports, totals = compile_library(args.codes_dir, not args.check)
+    if args.json:
+        json.dump({'files': [r.as_dict() for r in reports], 'totals': totals},
+                  sys.stdout, indent=2)
+        print()
+    else:
+        _print_report(reports, totals, args.verbose)
+
+    return 1 if any(r.errors for r in reports) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,7 +4,12 @@ from .abstract_controller import (
   BROADLINK_CONTROLLER, XIAOMI_CONTROLLER, MQTT_CONTROLLER, LOOKIN_CONTROLLER, ESPHOME_CONTROLLER,
   get_controller,
   to_lirc,
+  TRANSCODE_CACHE,
 )
+from .transcode_store import TRANSCODE_STORE, CODEC_VERSION
+from .http_transport import HTTP_TRANSPORT
+from .scheduler import SEND_SCHEDULER
+from .tracing import SEND_TRACER
 from .broadlink_controller import BroadlinkController
 from .mqtt_controller import MQTTController
 from .lookin_controller import LookinController
@@ -1,4 +1,12 @@
 from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+import hashlib
+import json
+
+from .scheduler import SEND_SCHEDULER
+from .tracing import SEND_TRACER, TRANSCODE
+from .transcode_store import TRANSCODE_STORE
 
 BROADLINK_CONTROLLER = 'Broadlink'
 XIAOMI_CONTROLLER = 'Xiaomi'
@@ -11,6 +19,8 @@ ENC_HEX = 'Hex'
 ENC_PRONTO = 'Pronto'
 ENC_RAW = 'Raw'
 
+TRANSCODE_CACHE_SIZE = 512
+
 def get_controller(name):
   return AbstractController.get(name)
 
@@ -18,10 +28,62 @@ def to_lirc(command, data):
   Controller = AbstractController.controllers[data._supported_controller]
   return Controller.toLirc(command, data)
 
+def code_hash(command):
+  """Return a short digest identifying a command."""
+  if type(command) is not str:
+    command = json.dumps(command, separators=(',', ':'))
+  return hashlib.blake2b(command.encode('utf-8'), digest_size=16).digest()
+
+_MISSING = object()
+
+class TranscodeCache():
+  """Bounded LRU cache of decoded commands."""
+  def __init__(self, maxsize=TRANSCODE_CACHE_SIZE):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._data = OrderedDict()
+
+  def get(self, key, default=None):
+    value = self._data.get(key, _MISSING)
+    if value is _MISSING:
+      self.misses += 1
+      return default
+    self.hits += 1
+    self._data.move_to_end(key)
+    return value
+
+  def put(self, key, value):
+    self._data[key] = value
+    self._data.move_to_end(key)
+    while len(self._data) > self.maxsize:
+      self._data.popitem(last=False)
+      self.evictions += 1
+
+  def clear(self):
+    self._data.clear()
+
+  def __len__(self):
+    return len(self._data)
+
+  def stats(self):
+    return {
+      'size': len(self._data),
+      'maxsize': self.maxsize,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+    }
+
+TRANSCODE_CACHE = TranscodeCache()
+
 # Singleton Controller Class
 class AbstractController(ABC):
   controllers = {}
   name = "None" # the Controller Name to register
+  # whether the decoded command depends on the entity's controller_data
+  decode_uses_controller_data = False
   def __new__(cls, *args, **kwargs):
     # if not hasattr(cls, 'instance'): # this will check attr derived in given class
     if 'instance' not in cls.__dict__:
@@ -39,7 +101,30 @@ class AbstractController(ABC):
     """decode a command."""
     return True, command
 
+  def decode_options(self, data):
+    """Return the settings of the controller, other than the entity's, that
+    change how a command is decoded. They are part of the cache keys."""
+    return None
+
   def decode(self, command, data):
+    key = (
+      data._supported_controller, data._supported_controller_type, data._commands_encoding,
+      self.name, data._controller_type,
+      data._controller_data if self.decode_uses_controller_data else None,
+      self.decode_options(data),
+      code_hash(command),
+    )
+    result = TRANSCODE_CACHE.get(key, _MISSING)
+    if result is not _MISSING:
+      return result
+
+    source = getattr(data, '_device_source', None)
+    if source is not None:
+      result = TRANSCODE_STORE.get(source, key, _MISSING)
+      if result is not _MISSING:
+        TRANSCODE_CACHE.put(key, result)
+        return result
+
     ok = False
     if data._supported_controller == self.name:
       ok, command = self._decode(command, data)
@@ -55,6 +140,9 @@ class AbstractController(ABC):
                         encoding = data._commands_encoding,
                         me = self.name)
                       )
+    TRANSCODE_CACHE.put(key, command)
+    if source is not None:
+      TRANSCODE_STORE.put(source, key, command)
     return command
 
   @abstractmethod
@@ -62,10 +150,39 @@ class AbstractController(ABC):
     """Send a command."""
     pass
 
+  def transmitter(self, data):
+    """Return the key of the physical transmitter the entity sends through."""
+    return (self.name, data._controller_data)
+
   async def send(self, command, data):
     """Send a command."""
-    await self._send(self.decode(command, data), data)
+    with SEND_TRACER.span(controller=self.name) as span:
+      with span.stage(TRANSCODE):
+        command = self.decode(command, data)
+      await SEND_SCHEDULER.run(self.transmitter(data), self._send, command, data)
+
+  async def _send_sequence(self, steps, data):
+    last = len(steps) - 1
+    for index, (command, gap) in enumerate(steps):
+      await self._send(command, data)
+      if gap and index < last:
+        await asyncio.sleep(gap)
+
+  async def send_sequence(self, steps, data):
+    """Send several commands in one turn of the transmitter.
+
+    `steps` is a list of (command, gap) pairs, the gap being the seconds
+    to wait after sending the command. All commands are decoded before
+    the first one is sent.
+    """
+    with SEND_TRACER.span(controller=self.name) as span:
+      with span.stage(TRANSCODE):
+        steps = [(self.decode(command, data), gap) for command, gap in steps]
+      await SEND_SCHEDULER.run(self.transmitter(data), self._send_sequence, steps, data)
 
+  async def send_repeat(self, command, times, data):
+    """Send a command `times` times in one turn of the transmitter."""
+    await self.send_sequence([(command, SEND_SCHEDULER.min_gap)] * times, data)
 
   @classmethod
   def register(cls):
@@ -7,7 +7,9 @@ from .abstract_controller import (
   ENC_BASE64, ENC_HEX, ENC_PRONTO,
   BROADLINK_CONTROLLER,
 )
-from .. import Helper
+from .scheduler import SEND_SCHEDULER
+from .tracing import SEND_TRACER, TRANSCODE
+from .. import Helper, codec
 
 class BroadlinkController(AbstractController):
   """Controls a Broadlink device."""
@@ -55,15 +57,15 @@ class BroadlinkController(AbstractController):
 
     return ok, command
 
-  async def _send(self, command, data):
+  async def _send(self, command, data, delay=None):
       service_data = {
         ATTR_ENTITY_ID: data._controller_data,
         'command':  command,
-        'delay_secs': data._delay
+        'delay_secs': data._delay if delay is None else delay
       }
 
       await data.hass.services.async_call(
-        'remote', 'send_command', service_data)
+        'remote', 'send_command', service_data, blocking=True)
 
 
   async def send(self, command, data):
@@ -72,8 +74,63 @@ class BroadlinkController(AbstractController):
     if not isinstance(command, list):
       command = [command]
 
-    for _command in command:
-      commands.append('b64:' + self.decode(_command, data))
-    await self._send(commands, data)
+    with SEND_TRACER.span(controller=self.name) as span:
+      with span.stage(TRANSCODE):
+        for _command in command:
+          commands.append('b64:' + self.decode(_command, data))
+      await SEND_SCHEDULER.run(self.transmitter(data), self._send, commands, data)
+
+  def _sequence(self, steps, data):
+    """Return how to send a sequence, as a send method and its arguments."""
+    commands = []
+    gaps = []
+    for command, gap in steps:
+      if not isinstance(command, list):
+        command = [command]
+      for _command in command:
+        commands.append(self.decode(_command, data))
+        gaps.append(float(data._delay))
+      # an empty step adds no gap of its own
+      if command:
+        gaps[-1] = gap
+    if gaps:
+      gaps.pop()
+
+    if len(set(gaps)) <= 1:
+      delay = gaps[0] if gaps else None
+      return self._send, (['b64:' + command for command in commands], data, delay)
+
+    try:
+      command = b64encode(codec.fuse_broadlink(commands, gaps)).decode('utf-8')
+    except ValueError:
+      # too long for one packet, send them one by one
+      steps = [(['b64:' + command], gap) for command, gap in zip(commands, gaps + [0])]
+      return self._send_sequence, (steps, data)
+    return self._send, (['b64:' + command], data)
+
+  async def send_sequence(self, steps, data):
+    """Send several commands with one `remote.send_command` call.
+
+    When the gaps between the commands are all the same they become the
+    call's delay, otherwise the commands are fused into one packet.
+    """
+    with SEND_TRACER.span(controller=self.name) as span:
+      with span.stage(TRANSCODE):
+        send, args = self._sequence(steps, data)
+      await SEND_SCHEDULER.run(self.transmitter(data), send, *args)
+
+  async def send_repeat(self, command, times, data):
+    """Send a command `times` times using the repeat byte of its packet."""
+    if isinstance(command, list):
+      return await super().send_repeat(command, times, data)
+
+    gap = SEND_SCHEDULER.min_gap
+    with SEND_TRACER.span(controller=self.name) as span:
+      with span.stage(TRANSCODE):
+        commands = [
+          'b64:' + b64encode(packet).decode('utf-8')
+          for packet in codec.repeat_broadlink(self.decode(command, data), times, gap)
+        ]
+      await SEND_SCHEDULER.run(self.transmitter(data), self._send, commands, data, gap)
 
 BroadlinkController.register()
@@ -1,13 +1,60 @@
+import inspect
 import json
+import logging
 
 from .abstract_controller import (
   AbstractController,
   ENC_RAW,
   ESPHOME_CONTROLLER,
 )
+
+_LOGGER = logging.getLogger(__name__)
+
+COMMAND_ARG = 'command'
+CARRIER_FREQUENCY_ARG = 'carrier_frequency'
+DEFAULT_CARRIER_FREQUENCY = 38000 # Hz
+# longest gap sent inside one raw code, the transmitter is busy meanwhile
+MAX_FUSED_GAP = 1.0 # seconds
+
+def _user_service(hass, name):
+  """Find the ESPHome user service registered as `esphome.<name>`.
+
+  Returns the entry data of its node and the service, or None when it
+  isn't known (yet).
+  """
+  # these are internals of the esphome integration, which may change
+  try:
+    from homeassistant.components.esphome import DomainData
+
+    domain_data = DomainData.get(hass)
+    for entry in hass.config_entries.async_entries('esphome'):
+      if not domain_data.is_entry_loaded(entry):
+        continue
+      entry_data = domain_data.get_entry_data(entry)
+      if entry_data.device_info is None:
+        continue
+      prefix = entry_data.device_info.name.replace('-', '_') + '_'
+      if not name.startswith(prefix):
+        continue
+      for service in entry_data.services.values():
+        if prefix + service.name == name:
+          return entry_data, service
+  except Exception as e:
+    _LOGGER.debug("Unable to look up the ESPHome service %s: %r", name, e)
+  return None
+
 class ESPHomeController(AbstractController):
-  """Controls a ESPHome device."""
+  """Controls a ESPHome device.
+
+  Commands are raw codes, positive numbers being marks and negative
+  numbers spaces in µs. They are sent through the native API client of
+  the node running the user-defined service, falling back to calling
+  the `esphome.<service>` service. A service declaring a
+  `carrier_frequency: int` variable gets the carrier frequency too.
+  """
   name = ESPHOME_CONTROLLER
+  # controller data => (entry data, user service)
+  _services = {}
 
   @classmethod
   def toLirc(cls, command, data):
@@ -15,24 +62,82 @@ class ESPHomeController(AbstractController):
     if data._supported_controller == cls.name:
       if data._commands_encoding == ENC_RAW:
         command = json.loads(command) if type(command) is str else command
+        command = [abs(int(pulse)) for pulse in command]
         ok = True
     return ok, command
   @classmethod
   def fromLirc(cls, command, data):
-    return True, command
+    return True, [-pulse if index % 2 else pulse for index, pulse in enumerate(command)]
 
   def _decode(self, command, data):
     ok = False
     if data._commands_encoding == ENC_RAW:
       command = json.loads(command) if type(command) is str else command
+      command = [int(pulse) for pulse in command]
       ok = True
     return ok, command
 
+  def _service(self, data):
+    """Return the entry data and user service behind controller_data."""
+    found = self._services.get(data._controller_data)
+    if found is not None:
+      entry_data, service = found
+      try:
+        # the node reconnected or was reloaded meanwhile
+        if not entry_data.available or entry_data.services.get(service.key) is not service:
+          found = None
+      except Exception:
+        found = None
+    if found is None:
+      found = _user_service(data.hass, data._controller_data)
+      if found is None:
+        self._services.pop(data._controller_data, None)
+      else:
+        self._services[data._controller_data] = found
+    return found
+
   async def _send(self, command, data):
     """Send a command."""
-    service_data = {'command':  command}
+    found = self._service(data)
+    if found is not None:
+      entry_data, service = found
+      args = {COMMAND_ARG: command, CARRIER_FREQUENCY_ARG: DEFAULT_CARRIER_FREQUENCY}
+      try:
+        names = [arg.name for arg in service.args]
+        if not all(name in args for name in names):
+          raise ValueError("unsupported arguments {}".format(names))
+        result = entry_data.client.execute_service(
+          service, {name: args[name] for name in names})
+      except Exception as e:
+        _LOGGER.debug("Calling the ESPHome API of %s failed (%s), calling the service",
+                      data._controller_data, e)
+      else:
+        # execute_service is a plain method in recent aioesphomeapi versions,
+        # the frame is on its way once it returned and mustn't be sent again
+        if inspect.isawaitable(result):
+          await result
+        return
+
+    service_data = {COMMAND_ARG:  command}
 
     await data.hass.services.async_call(
-        'esphome', data._controller_data, service_data)
+        'esphome', data._controller_data, service_data, blocking=True)
+
+  async def _send_sequence(self, steps, data):
+    """Send the commands as one raw code, the gaps becoming spaces."""
+    if any(gap > MAX_FUSED_GAP for command, gap in steps[:-1]):
+      return await super()._send_sequence(steps, data)
+
+    fused = []
+    last = len(steps) - 1
+    for index, (command, gap) in enumerate(steps):
+      fused += command
+      if index < last and gap:
+        space = int(gap * 1000000)
+        if fused and fused[-1] < 0:
+          fused[-1] = min(fused[-1], -space)
+        else:
+          fused.append(-space)
+    await self._send(fused, data)
 
 ESPHomeController.register()
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 5 # seconds
+DEFAULT_CONNECTIONS_PER_HOST = 2
+KEEPALIVE_TIMEOUT = 60 # seconds
+
+def _new_stats():
+  return {
+    'requests': 0,
+    'connections_created': 0,
+    'connections_reused': 0,
+    'timeouts': 0,
+    'errors': 0,
+  }
+
+class HttpTransport():
+  """Keep-alive HTTP client for the controllers sending commands over HTTP.
+
+  Connections are pooled and kept alive per host, and each host gets at
+  most `connections_per_host` requests at a time; further sends wait for
+  their turn. Counts the requests, and the connections created and reused
+  per host.
+  """
+  def __init__(self, timeout=DEFAULT_TIMEOUT, connections_per_host=DEFAULT_CONNECTIONS_PER_HOST):
+    self.timeout = timeout
+    self.connections_per_host = connections_per_host
+    self._session = None
+    self._semaphores = {}
+    self._stats = {}
+
+  def configure(self, timeout=None, connections_per_host=None):
+    """Change the settings, they apply to sessions and hosts used afterwards."""
+    if timeout is not None:
+      self.timeout = timeout
+    if connections_per_host is not None:
+      self.connections_per_host = connections_per_host
+
+  def _host_stats(self, host):
+    stats = self._stats.get(host)
+    if stats is None:
+      stats = self._stats[host] = _new_stats()
+    return stats
+
+  async def _on_connection_create(self, session, context, params):
+    self._host_stats(context.trace_request_ctx['host'])['connections_created'] += 1
+
+  async def _on_connection_reuse(self, session, context, params):
+    self._host_stats(context.trace_request_ctx['host'])['connections_reused'] += 1
+
+  def _get_session(self):
+    if self._session is None or self._session.closed:
+      trace_config = aiohttp.TraceConfig()
+      trace_config.on_connection_create_end.append(self._on_connection_create)
+      trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+      self._session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+          limit_per_host=self.connections_per_host, keepalive_timeout=KEEPALIVE_TIMEOUT),
+        timeout=aiohttp.ClientTimeout(total=self.timeout),
+        trace_configs=[trace_config])
+    return self._session
+
+  async def get(self, url):
+    """Request a URL and return the response status."""
+    host = urlsplit(url).netloc
+    semaphore = self._semaphores.get(host)
+    if semaphore is None:
+      semaphore = self._semaphores[host] = asyncio.Semaphore(self.connections_per_host)
+    stats = self._host_stats(host)
+
+    async with semaphore:
+      stats['requests'] += 1
+      try:
+        async with self._get_session().get(url, trace_request_ctx={'host': host}) as response:
+          # read the body, so that the connection goes back to the pool
+          await response.read()
+          return response.status
+      except asyncio.TimeoutError:
+        stats['timeouts'] += 1
+        raise
+      except aiohttp.ClientError:
+        stats['errors'] += 1
+        raise
+
+  def stats(self):
+    """Return the counters per host, with the share of requests that reused a connection."""
+    result = {}
+    for host, stats in self._stats.items():
+      connections = stats['connections_created'] + stats['connections_reused']
+      result[host] = dict(stats, reuse_ratio=(
+        stats['connections_reused'] / connections if connections else None))
+    return result
+
+  async def async_close(self):
+    if self._session is not None:
+      await self._session.close()
+      self._session = None
+
+HTTP_TRANSPORT = HttpTransport()
@@ -1,14 +1,18 @@
-import requests
+import logging
 
 from .abstract_controller import (
   AbstractController,
   ENC_PRONTO, ENC_RAW,
   LOOKIN_CONTROLLER
 )
+from .http_transport import HTTP_TRANSPORT
+
+_LOGGER = logging.getLogger(__name__)
 
 class LookinController(AbstractController):
   """Controls a Lookin device."""
   name = LOOKIN_CONTROLLER
+  decode_uses_controller_data = True
 
   def _decode(self, command, data):
     ok = False
@@ -21,7 +25,9 @@ class LookinController(AbstractController):
 
   async def _send(self, command, data):
     """Send a command."""
-    await data.hass.async_add_executor_job(requests.get, command)
+    status = await HTTP_TRANSPORT.get(command)
+    if status >= 400:
+      _LOGGER.warning("The LOOKin remote %s answered %s", data._controller_data, status)
 
 
 LookinController.register()
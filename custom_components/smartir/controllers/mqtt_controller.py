@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 import logging
 import json
 
@@ -6,11 +8,57 @@ from .abstract_controller import (
   ENC_RAW,
   MQTT_CONTROLLER
 )
+from .. import protocols
+
+# decode_type_t values of the protocols in IRremoteESP8266
+IRREMOTE_RAW = 30
+IRREMOTE_TYPES = {
+  protocols.NEC: 3,
+  protocols.SONY: 4,
+  protocols.SAMSUNG: 7,
+}
+IRREMOTE_PROTOCOLS = {value: key for key, value in IRREMOTE_TYPES.items()}
 
 _LOGGER = logging.getLogger(__name__)
+
+def _mqtt():
+  try:
+    from homeassistant.components import mqtt
+  except ImportError:
+    return None
+  return mqtt
+
 class MQTTController(AbstractController):
-  """Controls a MQTT device."""
+  """Controls a MQTT device.
+
+  Commands are published through the client of Home Assistant's MQTT
+  integration, skipping the `mqtt.publish` service call, with the
+  configured QoS and retain flag.
+
+  Commands converted from another controller are sent as a protocol and
+  value when they are NEC, Samsung or Sony codes, except to the gateways
+  configured to be sent raw pulses: `raw` is True for all gateways, or
+  the topics of these gateways.
+  """
   name = MQTT_CONTROLLER
+  qos = 0
+  retain = False
+  raw = False
+
+  def configure(self, qos=None, retain=None, raw=None):
+    if qos is not None:
+      self.qos = qos
+    if retain is not None:
+      self.retain = retain
+    if raw is not None:
+      self.raw = raw if type(raw) is bool else frozenset(raw)
+
+  def sends_raw(self, topic):
+    """Whether the gateway listening on a topic is only sent raw pulses."""
+    return self.raw is True or (self.raw is not False and topic in self.raw)
+
+  def decode_options(self, data):
+    return 'raw' if self.sends_raw(data._controller_data) else None
 
   @classmethod
   def toLirc(cls, command, data):
@@ -20,9 +68,15 @@ class MQTTController(AbstractController):
         if data._supported_controller_type == "IRremoteESP8266":
           if type(command) is str:
             # IRremoteESP8266 MQTT
-            command = list(map(int, command.split(",")))
-            if command[0] == 30: # only raw codes format supports currently
-              del command[:2] # remove first two items: [30,38000]
+            fields = command.split(",")
+            if int(fields[0]) == IRREMOTE_RAW:
+              command = list(map(int, fields[2:])) # remove first two items: [30,38000]
+              ok = True
+            elif int(fields[0]) in IRREMOTE_PROTOCOLS:
+              # type,code,bits[,repeat] with a hex code
+              command = protocols.encode(
+                IRREMOTE_PROTOCOLS[int(fields[0])], int(fields[1], 16), int(fields[2]),
+                int(fields[3]) if len(fields) > 3 else 0)
               ok = True
         else: # defaults to OpenMQTTGateway
           command = json.loads(command) if type(command) is str else command
@@ -31,15 +85,32 @@ class MQTTController(AbstractController):
           elif type(command) is dict and command["protocol_name"] == "Raw":
             command = list(map(int, command["Raw"].split(",")))
             ok = True
+          elif type(command) is dict and command["protocol_name"] in IRREMOTE_TYPES:
+            command = protocols.encode(
+              command["protocol_name"], int(command["value"]), int(command["bits"]),
+              int(command.get("repeat", 0)))
+            ok = True
     return ok, command
 
   @classmethod
   def fromLirc(cls, command, data):
+    # send the protocol and value instead of the pulses when it's known
+    decoded = None if cls().sends_raw(data._controller_data) else protocols.decode(command)
     if data._controller_type == "IRremoteESP8266":
-      command = [30,38000] + command
+      if decoded is not None:
+        command = [IRREMOTE_TYPES[decoded.protocol], '{:X}'.format(decoded.value), decoded.bits]
+        if decoded.repeat:
+          command.append(decoded.repeat)
+      else:
+        command = [IRREMOTE_RAW,38000] + command
       command = ','.join(list(map(str, command)))
     else:
-      command = { "raw": ','.join(list(map(str, command))), "protocol_name": "Raw"}
+      if decoded is not None:
+        command = {"value": decoded.value, "protocol_name": decoded.protocol, "bits": decoded.bits}
+        if decoded.repeat:
+          command["repeat"] = decoded.repeat
+      else:
+        command = { "raw": ','.join(list(map(str, command))), "protocol_name": "Raw"}
       command = json.dumps(command, indent=None)
     return True, command
 
@@ -56,13 +127,37 @@ class MQTTController(AbstractController):
 
   async def _send(self, command, data):
     """Send a command."""
+    mqtt = _mqtt()
+    if mqtt is not None:
+      result = mqtt.async_publish(
+        data.hass, data._controller_data, command, self.qos, self.retain)
+      # async_publish is a coroutine since Home Assistant 2022.3
+      if inspect.isawaitable(result):
+        await result
+      return
 
     service_data = {
         'topic': data._controller_data,
-        'payload': command
+        'payload': command,
+        'qos': self.qos,
+        'retain': self.retain,
     }
 
     await data.hass.services.async_call(
         'mqtt', 'publish', service_data)
 
+  async def _send_sequence(self, steps, data):
+    """Publish the frames in a burst.
+
+    A frame is published without waiting for the broker to acknowledge
+    the previous ones, the gaps are timed from the start of each publish.
+    """
+    last = len(steps) - 1
+    publishes = []
+    for index, (command, gap) in enumerate(steps):
+      publishes.append(asyncio.ensure_future(self._send(command, data)))
+      if gap and index < last:
+        await asyncio.sleep(gap)
+    await asyncio.gather(*publishes)
+
 MQTTController.register()
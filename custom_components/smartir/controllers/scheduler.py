@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from .tracing import QUEUE_WAIT, TRANSPORT, current_span
+
+MIN_FRAME_GAP = 0.1 # seconds
+
+class _Lane():
+  __slots__ = ('lock', 'ready_at', 'sends', 'wait_time')
+
+  def __init__(self):
+    self.lock = asyncio.Lock()
+    self.ready_at = 0.0
+    self.sends = 0
+    self.wait_time = 0.0
+
+class SendScheduler():
+  """Orders the transmissions of every IR transmitter.
+
+  A transmitter is identified by its controller and controller data (the
+  remote entity, MQTT topic, ESPHome service or LOOKin host), whichever
+  entity sends through it. Sends to one transmitter run one at a time in
+  the order they were made, at least `min_gap` seconds apart so that
+  their frames don't run into each other; sends to different
+  transmitters run in parallel. A send must only return once the
+  transmitter sent its frames, service calls are made blocking.
+  """
+  def __init__(self, min_gap=MIN_FRAME_GAP):
+    self.min_gap = min_gap
+    self._lanes = {}
+
+  def configure(self, min_gap=None):
+    if min_gap is not None:
+      self.min_gap = min_gap
+
+  async def run(self, transmitter, send, *args):
+    """Await `send(*args)` in the transmitter's turn."""
+    lane = self._lanes.get(transmitter)
+    if lane is None:
+      lane = self._lanes[transmitter] = _Lane()
+
+    start = time.monotonic()
+    async with lane.lock:
+      delay = lane.ready_at - time.monotonic()
+      if delay > 0:
+        await asyncio.sleep(delay)
+      lane.sends += 1
+      now = time.monotonic()
+      lane.wait_time += now - start
+      span = current_span()
+      if span is not None:
+        span.add(QUEUE_WAIT, now - start)
+      try:
+        return await send(*args)
+      finally:
+        lane.ready_at = time.monotonic() + self.min_gap
+        if span is not None:
+          span.add(TRANSPORT, lane.ready_at - self.min_gap - now)
+
+  def stats(self):
+    """Return the number of sends and the mean wait per transmitter."""
+    return {
+      transmitter: {
+        'sends': lane.sends,
+        'mean_wait': lane.wait_time / lane.sends if lane.sends else 0.0,
+        'queued': lane.lock.locked(),
+      }
+      for transmitter, lane in self._lanes.items()
+    }
+
+SEND_SCHEDULER = SendScheduler()
@@ -0,0 +1,177 @@
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import json
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+LOCK_WAIT = 'lock_wait' # waiting for the entity's previous send
+QUEUE_WAIT = 'queue_wait' # waiting for the transmitter's turn
+TRANSCODE = 'transcode'
+TRANSPORT = 'transport' # until the transmitter sent the frames
+TOTAL = 'total'
+STAGES = (LOCK_WAIT, QUEUE_WAIT, TRANSCODE, TRANSPORT, TOTAL)
+
+# upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+class Histogram():
+  """Counts durations in fixed buckets, for approximate percentiles."""
+  __slots__ = ('counts', 'count', 'sum', 'max')
+
+  def __init__(self):
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def add(self, value):
+    index = 0
+    while index < len(BUCKETS) and value > BUCKETS[index]:
+      index += 1
+    self.counts[index] += 1
+    self.count += 1
+    self.sum += value
+    if value > self.max:
+      self.max = value
+
+  def percentile(self, q):
+    """Return the upper bound of the bucket holding the q-th percentile."""
+    if not self.count:
+      return None
+    rank = q / 100 * self.count
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if count and seen >= rank:
+        return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+    return self.max
+
+  def summary(self):
+    return {
+      'count': self.count,
+      'mean': self.sum / self.count if self.count else None,
+      'max': self.max,
+      'p50': self.percentile(50),
+      'p90': self.percentile(90),
+      'p99': self.percentile(99),
+    }
+
+class _Stats():
+  __slots__ = ('stages', 'failures')
+
+  def __init__(self):
+    self.stages = {stage: Histogram() for stage in STAGES}
+    self.failures = 0
+
+  def summary(self):
+    return {
+      'failures': self.failures,
+      'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()},
+    }
+
+class Span():
+  """The stage timings of one send."""
+  __slots__ = ('entity', 'controller', 'stages', 'ok')
+
+  def __init__(self, entity=None, controller=None):
+    self.entity = entity
+    self.controller = controller
+    self.stages = {}
+    self.ok = True
+
+  def add(self, stage, duration):
+    self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+  @contextmanager
+  def stage(self, stage):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(stage, time.perf_counter() - start)
+
+_CURRENT_SPAN = contextvars.ContextVar('smartir_send_span', default=None)
+
+def current_span():
+  """Return the span of the send in progress in this task, if any."""
+  return _CURRENT_SPAN.get()
+
+class SendTracer():
+  """Times the stages of every send.
+
+  An entity's send and the controller send it makes share one span. Each
+  finished span is logged as a JSON debug event and added to the
+  histograms of its controller and of its entity.
+  """
+  def __init__(self):
+    self._controllers = {}
+    self._entities = {}
+
+  @contextmanager
+  def span(self, entity=None, controller=None):
+    """Trace a send; a span opened inside another one joins it."""
+    span = _CURRENT_SPAN.get()
+    if span is not None:
+      if controller is not None:
+        span.controller = controller
+      try:
+        yield span
+      except Exception:
+        span.ok = False
+        raise
+      return
+
+    span = Span(entity, controller)
+    token = _CURRENT_SPAN.set(span)
+    start = time.perf_counter()
+    try:
+      yield span
+    except Exception:
+      span.ok = False
+      raise
+    finally:
+      _CURRENT_SPAN.reset(token)
+      span.add(TOTAL, time.perf_counter() - start)
+      self._record(span)
+
+  @asynccontextmanager
+  async def entity_send(self, entity, lock):
+    """Trace an entity's send, holding its lock meanwhile."""
+    with self.span(entity) as span:
+      with span.stage(LOCK_WAIT):
+        await lock.acquire()
+      try:
+        yield span
+      finally:
+        lock.release()
+
+  def _record(self, span):
+    for key, all_stats in ((span.controller, self._controllers), (span.entity, self._entities)):
+      if key is None:
+        continue
+      stats = all_stats.get(key)
+      if stats is None:
+        stats = all_stats[key] = _Stats()
+      for stage, duration in span.stages.items():
+        stats.stages[stage].add(duration)
+      if not span.ok:
+        stats.failures += 1
+
+    if _LOGGER.isEnabledFor(logging.DEBUG):
+      _LOGGER.debug("send %s", json.dumps({
+        'entity': span.entity,
+        'controller': span.controller,
+        'ok': span.ok,
+        'stages': {stage: round(duration, 6) for stage, duration in span.stages.items()},
+      }))
+
+  def stats(self):
+    """Return the stage histograms and failed sends per controller and per entity."""
+    return {
+      'controllers': {key: stats.summary() for key, stats in self._controllers.items()},
+      'entities': {key: stats.summary() for key, stats in self._entities.items()},
+    }
+
+SEND_TRACER = SendTracer()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from .. import COMPONENT_ABS_DIR
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bump whenever a controller converts commands differently, so that
+# commands transcoded by an older version are not reused, neither from
+# this store nor from variant code packs.
+CODEC_VERSION = 4
+
+STORE_DIR = os.path.join(COMPONENT_ABS_DIR, 'codes', '.transcoded')
+FLUSH_DELAY = 10 # seconds
+
+_MISSING = object()
+
+def key_digest(key):
+  """Return the on-disk key of a transcoding cache key."""
+  return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+
+def _fingerprint(path):
+  stat = os.stat(path)
+  return [stat.st_size, stat.st_mtime_ns]
+
+def _write_atomic(path, payload):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(payload, f, separators=(',', ':'))
+  os.replace(tmp_path, path)
+
+class TranscodeStore():
+  """Transcoded commands persisted across restarts.
+
+  Commands are stored in one shard per device file, keyed by the digest of
+  their transcoding cache key. A shard records the codec version and the
+  size and modification time of its device file, and is discarded when
+  either of them changed.
+  """
+  def __init__(self, path=STORE_DIR):
+    self.path = path
+    # source -> {'source': fingerprint, 'entries': {digest: command}}
+    self._shards = {}
+    self._dirty = set()
+    self._flush_handle = None
+
+  def _shard_path(self, source):
+    name = '_'.join(str(part) for part in source if part is not None)
+    return os.path.join(self.path, 'v{}'.format(CODEC_VERSION), name + '.json')
+
+  def load(self, source, device_file):
+    """Read the shard of a device file. Blocking, run it in an executor."""
+    fingerprint = _fingerprint(device_file)
+    shard_path = self._shard_path(source)
+    shard = None
+    try:
+      with open(shard_path) as f:
+        shard = json.load(f)
+    except FileNotFoundError:
+      pass
+    except Exception:
+      _LOGGER.warning("Discarding the invalid transcoding cache %s", shard_path)
+
+    if shard is None or shard.get('codec') != CODEC_VERSION or shard.get('source') != fingerprint:
+      if shard is not None:
+        _LOGGER.debug("Discarding the outdated transcoding cache %s", shard_path)
+      shard = {'codec': CODEC_VERSION, 'source': fingerprint, 'entries': {}}
+    self._shards[source] = shard
+
+  def get(self, source, key, default=None):
+    shard = self._shards.get(source)
+    if shard is None:
+      return default
+    return shard['entries'].get(key_digest(key), default)
+
+  def put(self, source, key, command):
+    shard = self._shards.get(source)
+    if shard is None:
+      return
+    shard['entries'][key_digest(key)] = command
+    self._dirty.add(source)
+    self._schedule_flush()
+
+  def _schedule_flush(self):
+    if self._flush_handle is not None:
+      return
+    try:
+      loop = asyncio.get_running_loop()
+    except RuntimeError:
+      return
+    self._flush_handle = loop.call_later(FLUSH_DELAY, self._async_flush, loop)
+
+  def _async_flush(self, loop):
+    self._flush_handle = None
+    loop.run_in_executor(None, self._write, self._take_dirty())
+
+  def _take_dirty(self):
+    pending = []
+    for source in self._dirty:
+      shard = self._shards[source]
+      pending.append((self._shard_path(source), dict(shard, entries=dict(shard['entries']))))
+    self._dirty.clear()
+    return pending
+
+  def _write(self, pending):
+    for shard_path, shard in pending:
+      try:
+        _write_atomic(shard_path, shard)
+      except Exception:
+        _LOGGER.warning("Unable to write the transcoding cache %s", shard_path)
+
+  def _cancel_flush(self):
+    if self._flush_handle is not None:
+      self._flush_handle.cancel()
+      self._flush_handle = None
+
+  async def async_flush(self, hass):
+    """Write all pending shards.
+
+    The pending shards are copied on the event loop, which owns them, and
+    only the copies are written in the executor.
+    """
+    self._cancel_flush()
+    pending = self._take_dirty()
+    if pending:
+      await hass.async_add_executor_job(self._write, pending)
+
+  def flush(self):
+    """Write all pending shards. Blocking, for scripts which don't run an
+    event loop using the store."""
+    self._cancel_flush()
+    self._write(self._take_dirty())
+
+TRANSCODE_STORE = TranscodeStore()
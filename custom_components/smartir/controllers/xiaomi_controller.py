@@ -25,6 +25,6 @@ class XiaomiController(AbstractController):
     }
 
     await data.hass.services.async_call(
-      'remote', 'send_command', service_data)
+      'remote', 'send_command', service_data, blocking=True)
 
 XiaomiController.register()
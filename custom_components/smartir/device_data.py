@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os.path
+import time
+from types import MappingProxyType
+
+import aiohttp
+from homeassistant.helpers import config_per_platform
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from . import (
+    DOMAIN, COMPONENT_ABS_DIR, Helper,
+    CONF_DEVICE_CODE, CONF_CONTROLLER, CONF_CONTROLLER_TYPE, CONF_CONTROLLER_DATA,
+)
+from . import codepack
+from .commands import CommandNode, JsonCommandSource, resident_bytes
+from .controllers import CODEC_VERSION, MQTT_CONTROLLER, TRANSCODE_STORE, get_controller
+
+_LOGGER = logging.getLogger(__name__)
+
+CODES_SOURCE = ("https://raw.githubusercontent.com/"
+                "smartHomeHub/SmartIR/master/"
+                "codes/{}/{}.json")
+
+PLATFORMS = ['climate', 'fan', 'media_player']
+
+# Number of device files read and parsed at the same time
+MAX_CONCURRENT_LOADS = 2
+MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_TIMEOUT = 30 # seconds
+DOWNLOAD_ATTEMPTS = 3
+RETRY_DELAY = 2 # seconds, doubled after every attempt
+
+
+def _freeze(value):
+    if type(value) is dict:
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if type(value) is list:
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def device_source(platform, config):
+    """Return the (platform, device_code, pack variant) an entity loads its
+    commands from."""
+    controller = config.get(CONF_CONTROLLER)
+    # the MQTT variant packs hold protocol codes, gateways sent raw pulses
+    # transcode the commands of the device file instead
+    if controller == MQTT_CONTROLLER and get_controller(MQTT_CONTROLLER).sends_raw(
+            config.get(CONF_CONTROLLER_DATA)):
+        controller = None
+    return (platform, config.get(CONF_DEVICE_CODE), codepack.pack_variant(
+        controller, config.get(CONF_CONTROLLER_TYPE)))
+
+
+def configured_devices(config):
+    """Return the (platform, device_code) of every SmartIR entity in the
+    configuration."""
+    devices = set()
+    for platform in PLATFORMS:
+        for platform_name, platform_config in config_per_platform(config, platform):
+            if platform_name != DOMAIN:
+                continue
+            try:
+                devices.add((platform, int(platform_config[CONF_DEVICE_CODE])))
+            except (KeyError, TypeError, ValueError):
+                # reported by the platform's config validation
+                pass
+    return sorted(devices)
+
+
+def _device_json_path(platform, device_code):
+    return os.path.join(COMPONENT_ABS_DIR, 'codes', platform, str(device_code) + '.json')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _prepare(device_files_absdir, device_json_path):
+    if not os.path.isdir(device_files_absdir):
+        os.makedirs(device_files_absdir)
+
+    return codepack.is_fresh(device_json_path) or os.path.exists(device_json_path)
+
+
+def _load_file(source, device_json_path):
+    device_data = None
+    variant = source[2]
+    if variant and codepack.is_fresh(device_json_path, variant, CODEC_VERSION):
+        try:
+            device_data = codepack.CodePack.load(device_json_path, variant).device_data
+        except Exception:
+            _LOGGER.warning("The %s code pack is invalid, falling back " \
+                            "to the device Json file.", variant)
+
+    if device_data is None and codepack.is_fresh(device_json_path):
+        try:
+            device_data = codepack.CodePack.load(device_json_path).device_data
+        except Exception:
+            _LOGGER.warning("The device code pack is invalid, falling back " \
+                            "to the device Json file.")
+
+    if device_data is None:
+        device_data = JsonCommandSource(device_json_path).device_data
+
+    try:
+        if os.path.exists(device_json_path):
+            TRANSCODE_STORE.load(source, device_json_path)
+        else:
+            TRANSCODE_STORE.load(source, codepack.pack_path_for(device_json_path))
+    except Exception:
+        _LOGGER.warning("Unable to load the transcoding cache of %s", device_json_path)
+
+    return _freeze(device_data)
+
+
+def _close_device_data(future):
+    """Release the commands of device data nobody holds anymore."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    device_data = future.result()
+    commands = device_data.get('commands') if device_data is not None else None
+    if isinstance(commands, CommandNode):
+        commands.close()
+
+
+class _Entry():
+    __slots__ = ('future', 'refs')
+
+    def __init__(self, future):
+        self.future = future
+        self.refs = 0
+
+
+class DeviceDataRegistry():
+    """Process-wide store of parsed device files.
+
+    Every device file is parsed once and the same read-only structure is
+    handed to all entities using its device code. Entities acquire the data
+    while they are set up and release it when they are removed; the data is
+    dropped once no entity holds it anymore.
+    """
+
+    def __init__(self, max_concurrent_loads=MAX_CONCURRENT_LOADS):
+        self._entries = {}
+        self._downloads = {}
+        self._max_concurrent_loads = max_concurrent_loads
+        self._semaphore = None
+        self._download_semaphore = None
+        # (platform, device_code, variant) -> seconds spent reading and parsing the file
+        self.load_times = {}
+
+    async def _async_download_file(self, hass, platform, device_code, device_json_path):
+        if self._download_semaphore is None:
+            self._download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+        session = async_get_clientsession(hass)
+        source = CODES_SOURCE.format(platform, device_code)
+        tmp_path = device_json_path + '.download'
+        delay = RETRY_DELAY
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            try:
+                async with self._download_semaphore:
+                    await asyncio.wait_for(
+                        Helper.downloader(source, tmp_path, session), DOWNLOAD_TIMEOUT)
+                # A download cut short must never look like a device file
+                await hass.async_add_executor_job(os.replace, tmp_path, device_json_path)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    await hass.async_add_executor_job(_remove, tmp_path)
+                    raise
+                _LOGGER.debug("Downloading %s failed (%r), retrying in %s seconds",
+                              source, e, delay)
+            except Exception:
+                # not found, or not retryable
+                await hass.async_add_executor_job(_remove, tmp_path)
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def _async_download(self, hass, platform, device_code, device_json_path):
+        """Download a device file, joining a download already in progress."""
+        task = self._downloads.get(device_json_path)
+        if task is None:
+            task = hass.async_create_task(self._async_download_file(
+                hass, platform, device_code, device_json_path))
+            self._downloads[device_json_path] = task
+            task.add_done_callback(lambda _: self._downloads.pop(device_json_path, None))
+        await asyncio.shield(task)
+
+    async def async_prefetch(self, hass, devices):
+        """Download the missing device files of (platform, device_code)
+        pairs concurrently, so that the platforms find them locally."""
+        def missing():
+            return [(platform, device_code) for platform, device_code in devices
+                    if not _prepare(os.path.dirname(_device_json_path(platform, device_code)),
+                                    _device_json_path(platform, device_code))]
+
+        devices = await hass.async_add_executor_job(missing)
+        if not devices:
+            return
+
+        _LOGGER.debug("Prefetching the device files %s", devices)
+        results = await asyncio.gather(*(
+            self._async_download(hass, platform, device_code,
+                                 _device_json_path(platform, device_code))
+            for platform, device_code in devices), return_exceptions=True)
+        for (platform, device_code), result in zip(devices, results):
+            if isinstance(result, Exception):
+                _LOGGER.debug("Prefetching the %s device file %s failed: %r",
+                              platform, device_code, result)
+
+    async def _async_load(self, hass, platform, device_code, variant):
+        device_json_path = _device_json_path(platform, device_code)
+        device_files_absdir = os.path.dirname(device_json_path)
+
+        exists = await hass.async_add_executor_job(
+            _prepare, device_files_absdir, device_json_path)
+
+        if not exists:
+            _LOGGER.warning("Couldn't find the device Json file. The component will " \
+                            "try to download it from the GitHub repo.")
+
+            try:
+                await self._async_download(hass, platform, device_code, device_json_path)
+            except Exception:
+                _LOGGER.error("There was an error while downloading the device Json file. " \
+                              "Please check your internet connection or if the device code " \
+                              "exists on GitHub. If the problem still exists please " \
+                              "place the file manually in the proper directory.")
+                return None
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent_loads)
+
+        async with self._semaphore:
+            start = time.monotonic()
+            try:
+                device_data = await hass.async_add_executor_job(
+                    _load_file, (platform, device_code, variant), device_json_path)
+            except Exception:
+                _LOGGER.error("The device Json file is invalid")
+                return None
+            elapsed = time.monotonic() - start
+
+        self.load_times[(platform, device_code, variant)] = elapsed
+        _LOGGER.debug("Loaded %s in %.3f seconds", device_json_path, elapsed)
+        return device_data
+
+    async def async_acquire(self, hass, platform, device_code, variant=None):
+        """Return the device data of a platform's device code, or None."""
+        key = (platform, device_code, variant)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry(hass.async_create_task(
+                self._async_load(hass, platform, device_code, variant)))
+            self._entries[key] = entry
+
+        entry.refs += 1
+        try:
+            device_data = await asyncio.shield(entry.future)
+        except asyncio.CancelledError:
+            self.release(platform, device_code, variant)
+            raise
+        if device_data is None:
+            self.release(platform, device_code, variant)
+        return device_data
+
+    def release(self, platform, device_code, variant=None):
+        """Drop a reference taken by `async_acquire`."""
+        key = (platform, device_code, variant)
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        entry.refs -= 1
+        if entry.refs <= 0:
+            del self._entries[key]
+            self.load_times.pop(key, None)
+            entry.future.add_done_callback(_close_device_data)
+
+    def resident_command_bytes(self):
+        """Return the memory held by the commands read from the loaded files."""
+        seen = set()
+        total = 0
+        for entry in list(self._entries.values()):
+            future = entry.future
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                continue
+            device_data = future.result()
+            if device_data is not None:
+                total += resident_bytes(device_data['commands'], seen)
+        return total
+
+
+DEVICE_DATA = DeviceDataRegistry()
@@ -1,7 +1,6 @@
 import asyncio
-import json
+from collections.abc import Mapping
 import logging
-import os.path
 
 import voluptuous as vol
 
@@ -22,11 +21,11 @@ from homeassistant.util.percentage import (
     percentage_to_ordered_list_item
 )
 from . import (
-    COMPONENT_ABS_DIR, Helper,
     CONF_UNIQUE_ID, CONF_DEVICE_CODE, CONF_CONTROLLER, CONF_CONTROLLER_TYPE, CONF_CONTROLLER_DATA,
     CONF_DELAY, CONF_POWER_SENSOR
 )
-from .controllers import get_controller
+from .controllers import get_controller, SEND_TRACER
+from .device_data import DEVICE_DATA, device_source
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -49,39 +48,9 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Fan platform."""
-    device_code = config.get(CONF_DEVICE_CODE)
-    device_files_subdir = os.path.join('codes', 'fan')
-    device_files_absdir = os.path.join(COMPONENT_ABS_DIR, device_files_subdir)
-
-    if not os.path.isdir(device_files_absdir):
-        os.makedirs(device_files_absdir)
-
-    device_json_filename = str(device_code) + '.json'
-    device_json_path = os.path.join(device_files_absdir, device_json_filename)
-
-    if not os.path.exists(device_json_path):
-        _LOGGER.warning("Couldn't find the device Json file. The component will " \
-                        "try to download it from the GitHub repo.")
-
-        try:
-            codes_source = ("https://raw.githubusercontent.com/"
-                            "smartHomeHub/SmartIR/master/"
-                            "codes/fan/{}.json")
-
-            await Helper.downloader(codes_source.format(device_code), device_json_path)
-        except Exception:
-            _LOGGER.error("There was an error while downloading the device Json file. " \
-                          "Please check your internet connection or if the device code " \
-                          "exists on GitHub. If the problem still exists please " \
-                          "place the file manually in the proper directory.")
-            return
-
-    with open(device_json_path) as j:
-        try:
-            device_data = json.load(j)
-        except Exception:
-            _LOGGER.error("The device JSON file is invalid")
-            return
+    device_data = await DEVICE_DATA.async_acquire(hass, *device_source('fan', config))
+    if device_data is None:
+        return
 
     async_add_entities([SmartIRFan(
         hass, config, device_data
@@ -93,6 +62,7 @@ class SmartIRFan(FanEntity, RestoreEntity):
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
+        self._device_source = device_source('fan', config)
         controller = config.get(CONF_CONTROLLER)
         self._controller_type = config.get(CONF_CONTROLLER_TYPE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
@@ -163,6 +133,11 @@ class SmartIRFan(FanEntity, RestoreEntity):
                 async_track_state_change(self.hass, self._power_sensor,
                                          self._async_power_sensor_changed)
 
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed from hass."""
+        await super().async_will_remove_from_hass()
+        DEVICE_DATA.release(*self._device_source)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -228,7 +203,7 @@ class SmartIRFan(FanEntity, RestoreEntity):
 
     async def async_set_preset_mode(self, preset_mode: str) -> None:
         command = self._commands['mode']
-        if type(command) is dict:
+        if isinstance(command, Mapping):
             command = command.get(preset_mode)
             if command:
                 try:
@@ -287,14 +262,14 @@ class SmartIRFan(FanEntity, RestoreEntity):
         await self.async_set_percentage(0)
 
     async def _send_command(self, command):
-        async with self._temp_lock:
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
             try:
                 await self._controller.send(command, self)
             except Exception as e:
                 _LOGGER.exception(e)
 
     async def send_command(self):
-        async with self._temp_lock:
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
             self._on_by_remote = False
             speed = self._speed
             direction = self._direction or 'default'
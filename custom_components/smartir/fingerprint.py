@@ -0,0 +1,417 @@
+"""Identify the device code of a captured IR frame.
+
+Every command of the code library is converted to lirc pulses and reduced
+to a fingerprint of the first burst of the frame: each pulse is quantized
+to short or long, compared with the short marks or spaces of the same
+frame. This is what tells two buttons of one protocol apart, and it does
+not change with the timing differences between two captures of the same
+button. Aligned blocks of the quantized pulses are kept in an inverted
+index.
+
+A query looks up the rarest blocks of the captured frame to collect the
+candidate frames, orders them by the Hamming distance of their quantized
+pulses, and scores the closest ones by the share of pulses matching within
+a tolerance. Only a handful of frames are compared pulse by pulse, so a
+query takes milliseconds instead of a scan of the whole library.
+
+The index is built the first time it is needed and saved next to the
+codes, it is rebuilt when a device file changes.
+"""
+from array import array
+import asyncio
+from collections import defaultdict
+import binascii
+import json
+import logging
+import os
+import struct
+import time
+
+from . import COMPONENT_ABS_DIR, Helper, codec
+from .commands import is_command
+from .controllers import (
+    AbstractController,
+    ENC_BASE64, ENC_HEX, ENC_PRONTO, ENC_RAW,
+    BROADLINK_CONTROLLER,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+CODES_DIR = os.path.join(COMPONENT_ABS_DIR, 'codes')
+INDEX_PATH = os.path.join(CODES_DIR, '.fingerprints')
+INDEX_VERSION = 2
+PLATFORMS = ['climate', 'fan', 'media_player']
+
+# A pause longer than this ends the first burst of a frame, the rest are repeats
+BURST_GAP = 15000 # µs
+MIN_PULSES = 8
+# A pulse is long when it is this much longer than the short pulses
+LONG_RATIO = 1.5
+SHORT_PERCENTILE = 0.2
+BLOCK_SIZE = 24
+# Number of blocks of a query looked up, rarest first
+QUERY_BLOCKS = 8
+CANDIDATES = 64
+SCORED_CANDIDATES = 8
+# Two pulses match when they differ by at most this share of the longer one
+TOLERANCE = 0.25
+# The index is dropped from memory when it wasn't queried for this long
+IDLE_TIMEOUT = 600 # seconds
+
+_HEADER = struct.Struct('<I')
+
+
+class _Source():
+    """Stands in for an entity when converting the commands of a device file."""
+
+    def __init__(self, controller, controller_type, encoding):
+        self._supported_controller = controller
+        self._supported_controller_type = controller_type
+        self._commands_encoding = encoding
+        self._controller_type = None
+        self._controller_data = None
+        self._delay = 0
+
+
+def _broadlink_pulses(command):
+    try:
+        return Helper.broadlink2lirc(command)
+    except Exception:
+        pass
+    # Frames with trailing padding or an unusual trailer: only keep the
+    # pulses the header announces
+    return codec.broadlink_payload2lirc(command)
+
+
+def to_pulses(command, controller, encoding, controller_type=None):
+    """Convert a command to lirc pulses, or return None."""
+    try:
+        if controller == BROADLINK_CONTROLLER and encoding == ENC_BASE64:
+            if type(command) is str and command.startswith('b64:'):
+                command = command[4:]
+            return _broadlink_pulses(command)
+        if controller == BROADLINK_CONTROLLER and encoding == ENC_HEX:
+            return _broadlink_pulses(binascii.unhexlify(command))
+        if encoding == ENC_PRONTO:
+            return Helper.pronto2lirc(bytearray.fromhex(command.replace(' ', '')))
+
+        Controller = AbstractController.controllers.get(controller)
+        if Controller is None:
+            return None
+        ok, pulses = Controller.toLirc(command, _Source(controller, controller_type, encoding))
+        return pulses if ok and type(pulses) is list else None
+    except Exception:
+        return None
+
+
+def parse_frame(command, encoding=None):
+    """Convert a captured frame to lirc pulses.
+
+    Without an encoding, a list is taken as raw pulses, a string of hex
+    words starting with 0000 as Pronto, a comma separated string as raw
+    pulses and any other string as a Broadlink Base64 packet.
+    """
+    if type(command) is list:
+        return [int(pulse) for pulse in command]
+    command = command.strip()
+    if encoding is None:
+        if command.replace(' ', '').startswith('0000') and \
+                all(c in '0123456789abcdefABCDEF ' for c in command):
+            encoding = ENC_PRONTO
+        elif ',' in command:
+            encoding = ENC_RAW
+        else:
+            encoding = ENC_BASE64
+
+    if encoding == ENC_RAW:
+        return [int(pulse) for pulse in command.strip('[]').split(',')]
+    pulses = to_pulses(command, BROADLINK_CONTROLLER, encoding)
+    if pulses is None:
+        raise ValueError("Unable to decode the {} frame".format(encoding))
+    return pulses
+
+
+def first_burst(pulses):
+    """Return the absolute pulse lengths up to the first long pause."""
+    burst = []
+    for pulse in pulses:
+        pulse = min(abs(int(pulse)), 0xffff)
+        if pulse >= BURST_GAP and len(burst) >= MIN_PULSES:
+            break
+        burst.append(pulse)
+    return burst
+
+
+def quantize(burst):
+    """Return 1 for every long and 0 for every short pulse of a burst."""
+    symbols = bytearray(len(burst))
+    for role in (0, 1): # marks, spaces
+        pulses = sorted(burst[role::2])
+        if not pulses:
+            continue
+        threshold = LONG_RATIO * pulses[int(len(pulses) * SHORT_PERCENTILE)]
+        for i in range(role, len(burst), 2):
+            if burst[i] > threshold:
+                symbols[i] = 1
+    return bytes(symbols)
+
+
+def _blocks(symbols):
+    return {hash((i, symbols[i:i + BLOCK_SIZE])) for i in range(0, len(symbols), BLOCK_SIZE)}
+
+
+def _bits(symbols):
+    return int.from_bytes(symbols, 'big')
+
+
+def similarity(a, b):
+    """Share of pulses of the longer burst which match the other burst."""
+    if not a or not b:
+        return 0.0
+    matches = 0
+    for x, y in zip(a, b):
+        if abs(x - y) <= TOLERANCE * (x if x > y else y):
+            matches += 1
+    return matches / max(len(a), len(b))
+
+
+def _iter_leaves(node, path=()):
+    for key, value in node.items():
+        if type(value) is dict and not is_command(value):
+            yield from _iter_leaves(value, path + (key,))
+        elif value is not None:
+            yield path + (key,), value
+
+
+def library_fingerprint(codes_dir=CODES_DIR):
+    """Number, total size and latest modification of the device files."""
+    count = size = mtime = 0
+    for platform in PLATFORMS:
+        platform_dir = os.path.join(codes_dir, platform)
+        if not os.path.isdir(platform_dir):
+            continue
+        for entry in os.scandir(platform_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                count += 1
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime_ns)
+    return [count, size, mtime]
+
+
+class FingerprintIndex():
+    """Inverted index from quantized pulse blocks to the frames of the code library."""
+
+    def __init__(self):
+        # frame id -> (offset, length) of its burst in `pulses`
+        self.offsets = array('I')
+        self.lengths = array('I')
+        self.pulses = array('H')
+        # frame id -> [platform, device code, command path] of the commands sending it
+        self.commands = []
+        self.library = None
+        # commands of the library which couldn't be indexed
+        self.skipped = 0
+        self._symbols = []
+        self._postings = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def burst(self, frame):
+        offset = self.offsets[frame]
+        return self.pulses[offset:offset + self.lengths[frame]]
+
+    def _add(self, burst):
+        self.offsets.append(len(self.pulses))
+        self.lengths.append(len(burst))
+        self.pulses.extend(burst)
+
+    def _index(self):
+        postings = defaultdict(list)
+        self._symbols = []
+        for frame in range(len(self)):
+            symbols = quantize(self.burst(frame))
+            self._symbols.append(_bits(symbols))
+            for block in _blocks(symbols):
+                postings[block].append(frame)
+        self._postings = {block: array('I', frames) for block, frames in postings.items()}
+
+    def build(self, codes_dir=CODES_DIR):
+        """Index every command of a codes directory. Blocking."""
+        self.library = library_fingerprint(codes_dir)
+        frames = {}
+        for platform in PLATFORMS:
+            platform_dir = os.path.join(codes_dir, platform)
+            if not os.path.isdir(platform_dir):
+                continue
+            for name in sorted(os.listdir(platform_dir)):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(platform_dir, name)) as j:
+                        device_data = json.load(j)
+                    commands = device_data['commands']
+                    source = (device_data['supportedController'],
+                              device_data['commandsEncoding'],
+                              device_data.get('controllerType'))
+                except Exception:
+                    continue
+
+                device_code = int(name[:-5]) if name[:-5].isdigit() else name[:-5]
+                for path, command in _iter_leaves(commands):
+                    pulses = to_pulses(command, *source)
+                    burst = first_burst(pulses) if pulses else []
+                    if len(burst) < MIN_PULSES:
+                        self.skipped += 1
+                        _LOGGER.debug("Unable to index the %s command %s of %s device %s",
+                                      source[0], '/'.join(path), platform, device_code)
+                        continue
+
+                    key = array('H', burst).tobytes()
+                    frame = frames.get(key)
+                    if frame is None:
+                        frame = frames[key] = len(self)
+                        self._add(burst)
+                        self.commands.append([])
+                    self.commands[frame].append([platform, device_code, '/'.join(path)])
+
+        self._index()
+        return self
+
+    def save(self, path=INDEX_PATH):
+        header = json.dumps({
+            'version': INDEX_VERSION,
+            'library': self.library,
+            'commands': self.commands,
+            'skipped': self.skipped,
+        }, separators=(',', ':')).encode('utf-8')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(len(header)))
+            f.write(header)
+            for values in (self.offsets, self.lengths, self.pulses):
+                f.write(_HEADER.pack(len(values)))
+                values.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH, codes_dir=CODES_DIR):
+        """Load a saved index, or return None when it is missing or outdated."""
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.read(_HEADER.unpack(f.read(_HEADER.size))[0]))
+                if header['version'] != INDEX_VERSION or \
+                        header['library'] != library_fingerprint(codes_dir):
+                    return None
+                index = cls()
+                for values in (index.offsets, index.lengths, index.pulses):
+                    values.fromfile(f, _HEADER.unpack(f.read(_HEADER.size))[0])
+        except FileNotFoundError:
+            return None
+        except Exception:
+            _LOGGER.warning("Discarding the invalid fingerprint index %s", path)
+            return None
+
+        index.library = header['library']
+        index.commands = header['commands']
+        index.skipped = header['skipped']
+        index._index()
+        return index
+
+    def query(self, pulses, limit=5, platform=None):
+        """Return the device codes whose commands best match the pulses, best
+        first, as dicts of platform, device_code, score and matching commands."""
+        burst = first_burst(pulses)
+        if len(burst) < MIN_PULSES:
+            return []
+        symbols = quantize(burst)
+        bits = _bits(symbols)
+
+        hits = [self._postings[b] for b in _blocks(symbols) if b in self._postings]
+        hits.sort(key=len)
+        counts = defaultdict(int)
+        for frames in hits[:QUERY_BLOCKS]:
+            for frame in frames:
+                counts[frame] += 1
+        if platform:
+            # before keeping the best candidates, frames of other platforms
+            # must not crowd out the ones of the platform
+            commands = self.commands
+            counts = {frame: count for frame, count in counts.items()
+                      if any(command[0] == platform for command in commands[frame])}
+        candidates = sorted(counts, key=counts.get, reverse=True)[:CANDIDATES]
+        candidates.sort(key=lambda frame: (
+            bin(bits ^ self._symbols[frame]).count('1') +
+            abs(self.lengths[frame] - len(burst))))
+
+        devices = {}
+        for frame in candidates[:SCORED_CANDIDATES]:
+            score = round(similarity(burst, self.burst(frame)), 3)
+            for device_platform, device_code, path in self.commands[frame]:
+                if platform and device_platform != platform:
+                    continue
+                match = devices.get((device_platform, device_code))
+                if match is None or score > match['score']:
+                    match = devices[device_platform, device_code] = {
+                        'platform': device_platform,
+                        'device_code': device_code,
+                        'score': score,
+                        'commands': [],
+                    }
+                if score == match['score']:
+                    match['commands'].append(path)
+
+        ranked = sorted(devices.values(), key=lambda m: (-m['score'], str(m['device_code'])))
+        return ranked[:limit]
+
+
+def load_or_build(path=INDEX_PATH, codes_dir=CODES_DIR):
+    """Return the saved index, building and saving it when it is outdated. Blocking."""
+    index = FingerprintIndex.load(path, codes_dir)
+    if index is not None:
+        return index
+
+    start = time.monotonic()
+    index = FingerprintIndex().build(codes_dir)
+    _LOGGER.info("Indexed %d IR frames in %.1f seconds, %d commands could not be "
+                 "decoded", len(index), time.monotonic() - start, index.skipped)
+    try:
+        index.save(path)
+    except Exception:
+        _LOGGER.warning("Unable to save the fingerprint index %s", path)
+    return index
+
+
+class FingerprintCache():
+    """Holds the index while it is in use.
+
+    The index is loaded in the executor by the first query and dropped
+    again after it wasn't used for a while.
+    """
+
+    def __init__(self):
+        self._future = None
+        self._release_handle = None
+
+    async def async_get(self, hass):
+        if self._future is None:
+            self._future = hass.async_add_executor_job(load_or_build)
+        try:
+            index = await asyncio.shield(self._future)
+        except Exception:
+            self._future = None
+            raise
+
+        if self._release_handle is not None:
+            self._release_handle.cancel()
+        self._release_handle = hass.loop.call_later(IDLE_TIMEOUT, self._release)
+        return index
+
+    def _release(self):
+        self._future = None
+        self._release_handle = None
+
+
+FINGERPRINTS = FingerprintCache()
@@ -1,7 +1,6 @@
 import asyncio
-import json
+from collections import ChainMap
 import logging
-import os.path
 
 import voluptuous as vol
 
@@ -10,17 +9,20 @@ from homeassistant.components.media_player import (
 from homeassistant.components.media_player.const import (
     SUPPORT_TURN_OFF, SUPPORT_TURN_ON, SUPPORT_PREVIOUS_TRACK,
     SUPPORT_NEXT_TRACK, SUPPORT_VOLUME_STEP, SUPPORT_VOLUME_MUTE,
-    SUPPORT_PLAY_MEDIA, SUPPORT_SELECT_SOURCE, MEDIA_TYPE_CHANNEL)
+    SUPPORT_PLAY_MEDIA, SUPPORT_SELECT_SOURCE, SUPPORT_VOLUME_SET, MEDIA_TYPE_CHANNEL,
+    ATTR_MEDIA_VOLUME_LEVEL)
 from homeassistant.const import (
     CONF_NAME, STATE_OFF, STATE_ON, STATE_UNKNOWN)
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers import entity_platform
 from homeassistant.helpers.restore_state import RestoreEntity
 from . import (
-    COMPONENT_ABS_DIR, Helper,
     CONF_UNIQUE_ID, CONF_DEVICE_CODE, CONF_CONTROLLER, CONF_CONTROLLER_TYPE, CONF_CONTROLLER_DATA,
     CONF_DELAY, CONF_POWER_SENSOR
 )
-from .controllers import get_controller
+from .commands import CommandOverlay
+from .controllers import get_controller, SEND_TRACER
+from .device_data import DEVICE_DATA, device_source
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -30,6 +32,10 @@ DEFAULT_DELAY = 0.5
 
 CONF_SOURCE_NAMES = 'source_names'
 CONF_DEVICE_CLASS = 'device_class'
+CONF_VOLUME_STEPS = 'volume_steps'
+
+SERVICE_VOLUME_STEP = 'volume_step'
+ATTR_STEPS = 'steps'
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_UNIQUE_ID): cv.string,
@@ -41,60 +47,37 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_DELAY, default=DEFAULT_DELAY): cv.string,
     vol.Optional(CONF_POWER_SENSOR): cv.entity_id,
     vol.Optional(CONF_SOURCE_NAMES): dict,
-    vol.Optional(CONF_DEVICE_CLASS, default=DEFAULT_DEVICE_CLASS): cv.string
+    vol.Optional(CONF_DEVICE_CLASS, default=DEFAULT_DEVICE_CLASS): cv.string,
+    vol.Optional(CONF_VOLUME_STEPS): cv.positive_int
 })
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the IR Media Player platform."""
-    device_code = config.get(CONF_DEVICE_CODE)
-    device_files_subdir = os.path.join('codes', 'media_player')
-    device_files_absdir = os.path.join(COMPONENT_ABS_DIR, device_files_subdir)
-
-    if not os.path.isdir(device_files_absdir):
-        os.makedirs(device_files_absdir)
-
-    device_json_filename = str(device_code) + '.json'
-    device_json_path = os.path.join(device_files_absdir, device_json_filename)
-
-    if not os.path.exists(device_json_path):
-        _LOGGER.warning("Couldn't find the device Json file. The component will " \
-                        "try to download it from the GitHub repo.")
-
-        try:
-            codes_source = ("https://raw.githubusercontent.com/"
-                            "smartHomeHub/SmartIR/master/"
-                            "codes/media_player/{}.json")
-
-            await Helper.downloader(codes_source.format(device_code), device_json_path)
-        except Exception:
-            _LOGGER.error("There was an error while downloading the device Json file. " \
-                          "Please check your internet connection or if the device code " \
-                          "exists on GitHub. If the problem still exists please " \
-                          "place the file manually in the proper directory.")
-            return
-
-    with open(device_json_path) as j:
-        try:
-            device_data = json.load(j)
-        except Exception:
-            _LOGGER.error("The device JSON file is invalid")
-            return
+    device_data = await DEVICE_DATA.async_acquire(hass, *device_source('media_player', config))
+    if device_data is None:
+        return
 
     async_add_entities([SmartIRMediaPlayer(
         hass, config, device_data
     )])
 
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_VOLUME_STEP, {vol.Required(ATTR_STEPS): vol.Coerce(int)}, 'async_volume_step')
+
 class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
     def __init__(self, hass, config, device_data):
         self.hass = hass
         self._unique_id = config.get(CONF_UNIQUE_ID)
         self._name = config.get(CONF_NAME)
         self._device_code = config.get(CONF_DEVICE_CODE)
+        self._device_source = device_source('media_player', config)
         controller = config.get(CONF_CONTROLLER)
         self._controller_type = config.get(CONF_CONTROLLER_TYPE)
         self._controller_data = config.get(CONF_CONTROLLER_DATA)
         self._delay = config.get(CONF_DELAY)
         self._power_sensor = config.get(CONF_POWER_SENSOR)
+        self._volume_steps = config.get(CONF_VOLUME_STEPS)
 
         self._manufacturer = device_data['manufacturer']
         self._supported_models = device_data['supportedModels']
@@ -106,6 +89,7 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         self._state = STATE_OFF
         self._sources_list = []
         self._source = None
+        self._volume_level = None
         self._support_flags = 0
 
         self._device_class = config.get(CONF_DEVICE_CLASS)
@@ -126,6 +110,8 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         if ('volumeDown' in self._commands and self._commands['volumeDown'] is not None) \
         or ('volumeUp' in self._commands and self._commands['volumeUp'] is not None):
             self._support_flags = self._support_flags | SUPPORT_VOLUME_STEP
+            if self._volume_steps:
+                self._support_flags = self._support_flags | SUPPORT_VOLUME_SET
 
         if 'mute' in self._commands and self._commands['mute'] is not None:
             self._support_flags = self._support_flags | SUPPORT_VOLUME_MUTE
@@ -133,12 +119,11 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         if 'sources' in self._commands and self._commands['sources'] is not None:
             self._support_flags = self._support_flags | SUPPORT_SELECT_SOURCE | SUPPORT_PLAY_MEDIA
 
-            for source, new_name in config.get(CONF_SOURCE_NAMES, {}).items():
-                if source in self._commands['sources']:
-                    if new_name is not None:
-                        self._commands['sources'][new_name] = self._commands['sources'][source]
-
-                    del self._commands['sources'][source]
+            source_names = config.get(CONF_SOURCE_NAMES)
+            if source_names:
+                self._commands = ChainMap(
+                    {'sources': CommandOverlay(self._commands['sources'], source_names)},
+                    self._commands)
 
             #Sources list
             for key in self._commands['sources']:
@@ -157,12 +142,19 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
 
         if last_state is not None:
             self._state = last_state.state
+            if self._volume_steps:
+                self._volume_level = last_state.attributes.get(ATTR_MEDIA_VOLUME_LEVEL)
 
     @property
     def should_poll(self):
         """Push an update after each command."""
         return True
 
+    async def async_will_remove_from_hass(self):
+        """Run when entity will be removed from hass."""
+        await super().async_will_remove_from_hass()
+        DEVICE_DATA.release(*self._device_source)
+
     @property
     def unique_id(self):
         """Return a unique ID."""
@@ -193,6 +185,11 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
         """Content type of current playing media."""
         return MEDIA_TYPE_CHANNEL
 
+    @property
+    def volume_level(self):
+        """Volume level of the media player, when `volume_steps` is set."""
+        return self._volume_level
+
     @property
     def source_list(self):
         return self._sources_list
@@ -246,14 +243,32 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
 
     async def async_volume_down(self):
         """Turn volume down for media player."""
-        await self.send_command(self._commands['volumeDown'])
-        await self.async_update_ha_state()
+        await self.async_volume_step(-1)
 
     async def async_volume_up(self):
         """Turn volume up for media player."""
-        await self.send_command(self._commands['volumeUp'])
+        await self.async_volume_step(1)
+
+    async def async_volume_step(self, steps):
+        """Turn volume up, or down when steps is negative, by several steps at once."""
+        if steps:
+            command = self._commands['volumeUp' if steps > 0 else 'volumeDown']
+            await self.send_repeat(command, abs(steps))
+
+        if self._volume_level is not None:
+            level = round(self._volume_level * self._volume_steps) + steps
+            self._volume_level = min(max(level, 0), self._volume_steps) / self._volume_steps
         await self.async_update_ha_state()
 
+    async def async_set_volume_level(self, volume):
+        """Set volume level, counted in steps of `volume_steps`."""
+        target = round(volume * self._volume_steps)
+        if self._volume_level is None:
+            # the volume is unknown, go to the bottom first
+            await self.send_repeat(self._commands['volumeDown'], self._volume_steps)
+            self._volume_level = 0.0
+        await self.async_volume_step(target - round(self._volume_level * self._volume_steps))
+
     async def async_mute_volume(self, mute):
         """Mute the volume."""
         await self.send_command(self._commands['mute'])
@@ -278,17 +293,33 @@ class SmartIRMediaPlayer(MediaPlayerEntity, RestoreEntity):
             return
 
         self._source = "Channel {}".format(media_id)
-        for digit in media_id:
-            await self.send_command(self._commands['sources']["Channel {}".format(digit)])
+        delay = float(self._delay)
+        await self.send_sequence([
+            (self._commands['sources']["Channel {}".format(digit)], delay)
+            for digit in media_id])
         await self.async_update_ha_state()
 
     async def send_command(self, command):
-        async with self._temp_lock:
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
             try:
                 await self._controller.send(command, self)
             except Exception as e:
                 _LOGGER.exception(e)
 
+    async def send_repeat(self, command, times):
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
+            try:
+                await self._controller.send_repeat(command, times, self)
+            except Exception as e:
+                _LOGGER.exception(e)
+
+    async def send_sequence(self, steps):
+        async with SEND_TRACER.entity_send(self.entity_id, self._temp_lock):
+            try:
+                await self._controller.send_sequence(steps, self)
+            except Exception as e:
+                _LOGGER.exception(e)
+
     async def async_update(self):
         if self._power_sensor is None:
             return
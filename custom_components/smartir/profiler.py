@@ -0,0 +1,153 @@
+"""Profile the SmartIR code running on the event loop.
+
+Two profilers, both only keeping SmartIR code:
+
+- `sampling` samples the stack of the event loop every `interval` seconds
+  of CPU time and writes the stacks running SmartIR code in the folded
+  format of flamegraph.pl and speedscope, from the outermost SmartIR frame
+  inwards. The samples are taken by a SIGPROF handler when the loop runs
+  in the main thread, as in Home Assistant. Otherwise a background thread
+  samples the loop thread like the loop watchdog does, which is biased
+  towards the places the loop releases the GIL, such as waiting for I/O.
+- `cprofile` runs cProfile on the event loop thread and writes the
+  functions of SmartIR, with their SmartIR callers, as a pstats dump.
+"""
+import asyncio
+import cProfile
+from collections import Counter
+import os
+import pstats
+import signal
+import threading
+import time
+
+from .watchdog import PACKAGE_DIR, in_package, thread_frame
+
+MODE_SAMPLING = 'sampling'
+MODE_CPROFILE = 'cprofile'
+MODES = (MODE_SAMPLING, MODE_CPROFILE)
+
+DEFAULT_DURATION = 30 # seconds
+DEFAULT_INTERVAL = 0.005 # seconds between samples
+
+
+def _label(code):
+    filename = code.co_filename
+    if filename.startswith(PACKAGE_DIR):
+        filename = os.path.relpath(filename, PACKAGE_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return '{}:{}'.format(filename, code.co_name)
+
+
+class SamplingProfiler():
+    """Counts the stacks a thread runs from inside SmartIR."""
+
+    def __init__(self, thread_id, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._previous = None
+
+    @property
+    def use_signal(self):
+        """Whether the thread can be sampled by a SIGPROF handler."""
+        return (hasattr(signal, 'setitimer')
+                and self.thread_id == threading.main_thread().ident)
+
+    def _on_signal(self, signum, frame):
+        self.add(frame)
+
+    def start_signal(self):
+        """Start sampling on SIGPROF. Must be called on the main thread."""
+        self._previous = signal.signal(signal.SIGPROF, self._on_signal)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop_signal(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def sample(self):
+        self.add(thread_frame(self.thread_id))
+
+    def add(self, frame):
+        self.samples += 1
+        stack = []
+        outermost = 0
+        while frame is not None:
+            stack.append(frame.f_code)
+            if in_package(frame):
+                outermost = len(stack)
+            frame = frame.f_back
+        if outermost:
+            self.stacks[';'.join(_label(code) for code in reversed(stack[:outermost]))] += 1
+
+    def run(self, duration):
+        """Sample for `duration` seconds. Blocking, run it in another thread."""
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            self.sample()
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def _package_stats(profiler):
+    """Return the pstats of a profile, keeping SmartIR functions only."""
+    stats = pstats.Stats(profiler)
+    stats.stats = {
+        func: (cc, nc, tt, ct, {
+            caller: timing for caller, timing in callers.items()
+            if caller[0].startswith(PACKAGE_DIR)})
+        for func, (cc, nc, tt, ct, callers) in stats.stats.items()
+        if func[0].startswith(PACKAGE_DIR)
+    }
+    return stats
+
+
+class Profiling():
+    """Runs one profile at a time."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    async def async_profile(self, hass, mode=MODE_SAMPLING, duration=DEFAULT_DURATION,
+                            interval=DEFAULT_INTERVAL):
+        """Profile for `duration` seconds and return the path of the dump."""
+        async with self._lock:
+            name = 'smartir_profile_{}'.format(time.strftime('%Y%m%d_%H%M%S'))
+            if mode == MODE_CPROFILE:
+                path = hass.config.path(name + '.pstats')
+                profiler = cProfile.Profile()
+                # profiles the thread it's enabled on, the event loop
+                profiler.enable()
+                try:
+                    await asyncio.sleep(duration)
+                finally:
+                    profiler.disable()
+                await hass.async_add_executor_job(
+                    lambda: _package_stats(profiler).dump_stats(path))
+            else:
+                path = hass.config.path(name + '.folded')
+                profiler = SamplingProfiler(threading.get_ident(), interval)
+                if profiler.use_signal:
+                    profiler.start_signal()
+                    try:
+                        await asyncio.sleep(duration)
+                    finally:
+                        profiler.stop_signal()
+                else:
+                    await hass.async_add_executor_job(profiler.run, duration)
+                await hass.async_add_executor_job(profiler.dump, path)
+            return path
+
+
+PROFILING = Profiling()
@@ -0,0 +1,140 @@
+"""Recognise and generate the frames of common IR protocols.
+
+A frame is a list of lirc pulses in µs, starting with a mark. `decode`
+recognises NEC, Samsung and Sony frames, so that gateways able to send
+these protocols themselves can be sent a protocol, value and bit count
+instead of the raw pulses; `encode` turns them back into pulses.
+Values are MSB first, in the order the bits are transmitted, like
+IRremoteESP8266 and OpenMQTTGateway report them.
+"""
+from collections import namedtuple
+
+NEC = 'NEC'
+SAMSUNG = 'SAMSUNG'
+SONY = 'SONY'
+
+# relative and absolute tolerance of a measured pulse
+TOLERANCE = 0.25
+EXCESS = 100 # µs
+
+Protocol = namedtuple('Protocol', (
+    'name', 'header_mark', 'header_space', 'one_mark', 'one_space',
+    'zero_mark', 'zero_space', 'bits', 'footer_mark'))
+
+PROTOCOLS = (
+    Protocol(NEC, 9000, 4500, 560, 1690, 560, 560, (32,), 560),
+    Protocol(SAMSUNG, 4480, 4480, 560, 1680, 560, 560, (32,), 560),
+    # Sony encodes the bits in the marks and has no footer
+    Protocol(SONY, 2400, 600, 1200, 600, 600, 600, (20, 15, 12), None),
+)
+_BY_NAME = {protocol.name: protocol for protocol in PROTOCOLS}
+
+# sent instead of copies of a NEC code while the button is held
+NEC_REPEAT_CODE = (9000, 2250, 560)
+
+Decoded = namedtuple('Decoded', ('protocol', 'value', 'bits', 'repeat'))
+
+
+def _match(measured, expected):
+    return abs(measured - expected) <= expected * TOLERANCE + EXCESS
+
+
+def _decode_frame(protocol, pulses, start, bits):
+    """Decode one frame at `start`; returns (value, index after the frame)."""
+    end = start + 2 + bits * 2 + (1 if protocol.footer_mark else -1)
+    if end > len(pulses):
+        return None
+    if not (_match(pulses[start], protocol.header_mark)
+            and _match(pulses[start + 1], protocol.header_space)):
+        return None
+
+    value = 0
+    ix = start + 2
+    for bit in range(bits):
+        mark = pulses[ix]
+        # the space after the last Sony bit is the gap to the next frame
+        space = pulses[ix + 1] if ix + 1 < end else None
+        if _match(mark, protocol.one_mark) and (
+                space is None or _match(space, protocol.one_space)):
+            value = (value << 1) | 1
+        elif _match(mark, protocol.zero_mark) and (
+                space is None or _match(space, protocol.zero_space)):
+            value <<= 1
+        else:
+            return None
+        ix += 2
+
+    if protocol.footer_mark:
+        if not _match(pulses[ix], protocol.footer_mark):
+            return None
+        ix += 1
+    else:
+        ix -= 1
+    return value, ix
+
+
+def _is_nec_repeat(pulses, ix):
+    """Whether a NEC repeat code follows the gap at ix."""
+    return (len(pulses) - ix >= 4 and all(
+        _match(pulse, expected) for pulse, expected in zip(pulses[ix + 1:], NEC_REPEAT_CODE)))
+
+
+def decode(pulses):
+    """Recognise a frame; returns a Decoded tuple, or None for other protocols.
+
+    The frame must be sendable by the gateways as it is: `repeat` counts
+    the copies of a Samsung or Sony code, and the repeat codes (9000,
+    2250, 560) following a NEC code, which is how the gateways repeat NEC
+    codes. A NEC frame holding copies of its code isn't recognised.
+    """
+    for protocol in PROTOCOLS:
+        for bits in protocol.bits:
+            result = _decode_frame(protocol, pulses, 0, bits)
+            if result is None:
+                continue
+            value, ix = result
+            repeat = 0
+            # skip the gap after the frame and look for copies
+            while ix + 1 < len(pulses):
+                result = _decode_frame(protocol, pulses, ix + 1, bits)
+                if result is None or result[0] != value:
+                    break
+                repeat += 1
+                ix = result[1]
+            if protocol.name == NEC:
+                if repeat:
+                    continue
+                while ix + 1 < len(pulses) and _is_nec_repeat(pulses, ix):
+                    repeat += 1
+                    ix += 4
+            # a trailing gap is fine, anything else is not this protocol
+            if len(pulses) - ix > 1:
+                continue
+            return Decoded(protocol.name, value, bits, repeat)
+    return None
+
+
+def encode(name, value, bits, repeat=0, gap=40000):
+    """Return the lirc pulses of a frame sent 1 + `repeat` times, `gap` µs apart.
+
+    A NEC code is followed by `repeat` repeat codes instead of copies.
+    """
+    protocol = _BY_NAME[name]
+    frame = [protocol.header_mark, protocol.header_space]
+    for bit in range(bits - 1, -1, -1):
+        if (value >> bit) & 1:
+            frame += [protocol.one_mark, protocol.one_space]
+        else:
+            frame += [protocol.zero_mark, protocol.zero_space]
+    if protocol.footer_mark:
+        frame.append(protocol.footer_mark)
+    else:
+        frame.pop()
+
+    pulses = list(frame)
+    if protocol.name == NEC:
+        frame = NEC_REPEAT_CODE
+    for _ in range(repeat):
+        pulses.append(gap)
+        pulses += frame
+    return pulses
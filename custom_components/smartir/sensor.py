@@ -0,0 +1,155 @@
+"""Sensors reporting how SmartIR performs.
+
+Set up through discovery when `metrics: true` is in the smartir
+configuration. They are updated every minute.
+"""
+from datetime import timedelta
+import logging
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import DATA_BYTES, PERCENTAGE, TIME_MILLISECONDS, TIME_SECONDS
+from homeassistant.helpers.entity import EntityCategory
+
+from .commands import COMMAND_STORE
+from .controllers import HTTP_TRANSPORT, SEND_TRACER, TRANSCODE_CACHE
+from .controllers.tracing import TOTAL
+from .device_data import DEVICE_DATA
+
+_LOGGER = logging.getLogger(__name__)
+
+SCAN_INTERVAL = timedelta(seconds=60)
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    """Set up the SmartIR metrics sensors."""
+    if discovery_info is None:
+        return
+
+    async_add_entities([
+        SendsSensor(),
+        FailedSendsSensor(),
+        SendLatencySensor(),
+        TranscodeCacheSensor(),
+        DeviceFileLoadSensor(),
+        CommandDataSensor(),
+        HttpConnectionReuseSensor(),
+    ], True)
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+class SmartIRMetricSensor(SensorEntity):
+    """A SmartIR metric, measured by `_async_measure`."""
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _key = None
+    _label = None
+
+    def __init__(self):
+        self._attr_unique_id = 'smartir_' + self._key
+        self._attr_name = 'SmartIR ' + self._label
+
+    async def _async_measure(self):
+        """Return the state and the attributes of the sensor."""
+        raise NotImplementedError
+
+    async def async_update(self):
+        self._attr_native_value, self._attr_extra_state_attributes = \
+            await self._async_measure()
+
+class SendsSensor(SmartIRMetricSensor):
+    _key = 'sends'
+    _label = 'sends'
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+    _attr_icon = 'mdi:remote'
+
+    async def _async_measure(self):
+        stats = SEND_TRACER.stats()
+        return sum(s['stages'][TOTAL]['count'] for s in stats['controllers'].values()), {
+            kind: {key: s['stages'][TOTAL]['count'] for key, s in stats[kind].items()}
+            for kind in ('controllers', 'entities')
+        }
+
+class FailedSendsSensor(SmartIRMetricSensor):
+    _key = 'failed_sends'
+    _label = 'failed sends'
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+    _attr_icon = 'mdi:alert-circle-outline'
+
+    async def _async_measure(self):
+        stats = SEND_TRACER.stats()
+        return sum(s['failures'] for s in stats['controllers'].values()), {
+            kind: {key: s['failures'] for key, s in stats[kind].items() if s['failures']}
+            for kind in ('controllers', 'entities')
+        }
+
+class SendLatencySensor(SmartIRMetricSensor):
+    """The 90th percentile send time of the slowest controller."""
+    _key = 'send_latency'
+    _label = 'send latency'
+    _attr_native_unit_of_measurement = TIME_MILLISECONDS
+    _attr_icon = 'mdi:timer-outline'
+
+    async def _async_measure(self):
+        controllers = {}
+        for controller, stats in SEND_TRACER.stats()['controllers'].items():
+            controllers[controller] = {
+                stage: {
+                    'p50': _ms(summary['p50']),
+                    'p90': _ms(summary['p90']),
+                    'p99': _ms(summary['p99']),
+                    'mean': _ms(summary['mean']),
+                }
+                for stage, summary in stats['stages'].items() if summary['count']
+            }
+        p90s = [stages[TOTAL]['p90'] for stages in controllers.values() if TOTAL in stages]
+        return max(p90s) if p90s else None, controllers
+
+class TranscodeCacheSensor(SmartIRMetricSensor):
+    _key = 'transcode_cache_hit_ratio'
+    _label = 'transcode cache hit ratio'
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_icon = 'mdi:cached'
+
+    async def _async_measure(self):
+        stats = TRANSCODE_CACHE.stats()
+        lookups = stats['hits'] + stats['misses']
+        return round(stats['hits'] / lookups * 100, 1) if lookups else None, stats
+
+class DeviceFileLoadSensor(SmartIRMetricSensor):
+    """The load time of the slowest device file in use."""
+    _key = 'device_file_load_time'
+    _label = 'device file load time'
+    _attr_native_unit_of_measurement = TIME_SECONDS
+    _attr_icon = 'mdi:file-clock-outline'
+
+    async def _async_measure(self):
+        files = {
+            '/'.join(str(part) for part in source if part): round(elapsed, 3)
+            for source, elapsed in DEVICE_DATA.load_times.items()
+        }
+        return max(files.values()) if files else None, files
+
+class CommandDataSensor(SmartIRMetricSensor):
+    """The memory held by the commands read from the device files."""
+    _key = 'command_data'
+    _label = 'command data'
+    _attr_native_unit_of_measurement = DATA_BYTES
+    _attr_icon = 'mdi:memory'
+
+    async def _async_measure(self):
+        resident = await self.hass.async_add_executor_job(DEVICE_DATA.resident_command_bytes)
+        return resident, COMMAND_STORE.stats()
+
+class HttpConnectionReuseSensor(SmartIRMetricSensor):
+    """The share of HTTP requests sent over a kept-alive connection."""
+    _key = 'http_connection_reuse'
+    _label = 'HTTP connection reuse'
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_icon = 'mdi:lan-connect'
+
+    async def _async_measure(self):
+        stats = HTTP_TRANSPORT.stats()
+        created = sum(s['connections_created'] for s in stats.values())
+        reused = sum(s['connections_reused'] for s in stats.values())
+        ratio = round(reused / (created + reused) * 100, 1) if created + reused else None
+        return ratio, stats
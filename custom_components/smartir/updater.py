@@ -0,0 +1,177 @@
+"""Download the files of a new version of the component.
+
+Files are downloaded concurrently into a staging directory and only moved
+over the installed files once all of them were downloaded. Before moving
+them a commit marker is written, so that a swap interrupted by a crash or
+a restart is finished the next time the component is set up, and an
+interrupted download is thrown away. Either way the installed files are
+never a mix of two versions.
+
+The ETag of every downloaded file is remembered; unchanged files are
+answered with 304 Not Modified and not downloaded again.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+
+import aiofiles
+import aiohttp
+
+from . import COMPONENT_ABS_DIR
+
+_LOGGER = logging.getLogger(__name__)
+
+STAGING_DIR = os.path.join(COMPONENT_ABS_DIR, '.update')
+COMMIT_MARKER = 'COMMIT'
+ETAGS_FILE = os.path.join(COMPONENT_ABS_DIR, '.etags.json')
+
+MAX_PARALLEL_DOWNLOADS = 4
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_etags():
+    try:
+        with open(ETAGS_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        _LOGGER.warning("Discarding the invalid %s", ETAGS_FILE)
+        return {}
+
+
+def _prepare(files):
+    """Clear the staging directory, create the directories of the files in
+    it and return the ETags of the installed files that weren't modified
+    since they were downloaded. Blocking."""
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    os.makedirs(STAGING_DIR)
+    for file in files:
+        os.makedirs(os.path.dirname(os.path.join(STAGING_DIR, file)), exist_ok=True)
+
+    etags = {}
+    for file, entry in _load_etags().items():
+        if file not in files:
+            continue
+        try:
+            if entry['source'] == _fingerprint(os.path.join(COMPONENT_ABS_DIR, file)):
+                etags[file] = entry['etag']
+        except (OSError, KeyError, TypeError):
+            pass
+    return etags
+
+
+def _swap(files):
+    """Move the staged files over the installed ones. Blocking."""
+    for file in files:
+        staged = os.path.join(STAGING_DIR, file)
+        if not os.path.exists(staged):
+            # already moved by an interrupted swap
+            continue
+        dest = os.path.join(COMPONENT_ABS_DIR, file)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(staged, dest)
+
+
+def _commit(downloaded):
+    """Install the staged files and remember their ETags. Blocking."""
+    files = sorted(downloaded)
+    marker = os.path.join(STAGING_DIR, COMMIT_MARKER)
+    with open(marker + '.tmp', 'w') as f:
+        json.dump(files, f)
+    os.replace(marker + '.tmp', marker)
+
+    _swap(files)
+
+    etags = _load_etags()
+    for file, etag in downloaded.items():
+        if etag:
+            etags[file] = {
+                'etag': etag,
+                'source': _fingerprint(os.path.join(COMPONENT_ABS_DIR, file)),
+            }
+        else:
+            etags.pop(file, None)
+    tmp_path = ETAGS_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(etags, f)
+    os.replace(tmp_path, ETAGS_FILE)
+
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+
+
+def recover():
+    """Finish or throw away an interrupted update. Blocking.
+
+    Returns True when an interrupted swap was finished.
+    """
+    if not os.path.isdir(STAGING_DIR):
+        return False
+
+    marker = os.path.join(STAGING_DIR, COMMIT_MARKER)
+    finished = False
+    if os.path.exists(marker):
+        with open(marker) as f:
+            _swap(json.load(f))
+        finished = True
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    return finished
+
+
+async def _download(session, semaphore, source, dest, etag):
+    """Download a file to dest; returns (changed, ETag of the file)."""
+    headers = {'If-None-Match': etag} if etag else None
+    async with semaphore:
+        async with session.get(source, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status == 304:
+                return False, etag
+            if response.status != 200:
+                raise Exception("File not found")
+
+            async with aiofiles.open(dest, mode='wb') as f:
+                await f.write(await response.read())
+            return True, response.headers.get('ETag')
+
+
+async def async_update_files(hass, session, base_url, files,
+                             max_parallel=MAX_PARALLEL_DOWNLOADS):
+    """Download and install the files of a new version.
+
+    Returns the files that couldn't be downloaded; when there are any,
+    none of the installed files are touched.
+    """
+    etags = await hass.async_add_executor_job(_prepare, files)
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    results = await asyncio.gather(*(
+        _download(session, semaphore, base_url + file,
+                  os.path.join(STAGING_DIR, file), etags.get(file))
+        for file in files), return_exceptions=True)
+
+    failed = []
+    downloaded = {}
+    for file, result in zip(files, results):
+        if isinstance(result, BaseException):
+            _LOGGER.error("Error updating %s (%s). Please update the file manually.",
+                          file, result)
+            failed.append(file)
+            continue
+        changed, etag = result
+        if changed:
+            downloaded[file] = etag
+        else:
+            _LOGGER.debug("%s is unchanged", file)
+
+    if failed:
+        await hass.async_add_executor_job(shutil.rmtree, STAGING_DIR, True)
+        return failed
+
+    await hass.async_add_executor_job(_commit, downloaded)
+    return failed
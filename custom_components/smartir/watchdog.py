@@ -0,0 +1,128 @@
+"""Find the SmartIR code blocking the event loop.
+
+A callback on the event loop beats every `interval` seconds; a background
+thread checks how late the beat is. When the loop is blocked for longer
+than the threshold, the thread samples the stack the loop thread is
+running and, when it runs SmartIR code, logs it. Once the loop resumes
+the total time it was blocked is logged too.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+_LOGGER = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+DEFAULT_THRESHOLD = 0.2 # seconds
+MIN_INTERVAL = 0.005 # seconds
+
+
+def thread_frame(thread_id):
+    """Return the frame a thread is running, or None when it ended."""
+    return sys._current_frames().get(thread_id)
+
+
+def in_package(frame):
+    return frame.f_code.co_filename.startswith(PACKAGE_DIR)
+
+
+def package_frames(frame):
+    """Return the SmartIR frames of a stack, innermost first."""
+    frames = []
+    while frame is not None:
+        if in_package(frame):
+            frames.append(frame)
+        frame = frame.f_back
+    return frames
+
+
+def describe(frame):
+    return '{}:{} {}'.format(
+        os.path.relpath(frame.f_code.co_filename, PACKAGE_DIR), frame.f_lineno,
+        frame.f_code.co_name)
+
+
+class LoopWatchdog():
+    """Logs the SmartIR stack running when the event loop is blocked."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.configure(threshold)
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread = None
+        self._handle = None
+        self._thread = None
+        self._stop = threading.Event()
+        # when the next beat is expected, and the expected beat that was reported late
+        self._expected = 0.0
+        self._reported = None
+
+    def configure(self, threshold):
+        """Change the threshold, applies once the watchdog is (re)started."""
+        self.threshold = threshold
+        self.interval = max(threshold / 4, MIN_INTERVAL)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, loop):
+        """Start watching the loop. Must be called on the loop."""
+        if self.running:
+            return
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._schedule()
+        self._thread = threading.Thread(
+            target=self._watch, name='smartir_loop_watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching. Must be called on the loop."""
+        if not self.running:
+            return
+        self._stop.set()
+        self._handle.cancel()
+        self._thread = None
+
+    def _schedule(self):
+        self._expected = time.monotonic() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _beat(self):
+        if self._reported == self._expected:
+            _LOGGER.warning("The event loop was blocked for %.3f seconds",
+                            time.monotonic() - self._expected)
+            self._reported = None
+        self._schedule()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            expected = self._expected
+            late = time.monotonic() - expected
+            if late < self.threshold or self._reported == expected:
+                continue
+
+            frame = thread_frame(self._loop_thread)
+            if frame is None:
+                return
+            frames = package_frames(frame)
+            if not frames:
+                # not our code, check again while the loop stays blocked
+                continue
+
+            self._reported = expected
+            self.stalls += 1
+            _LOGGER.warning(
+                "The event loop is blocked for %.3f seconds in %s, called from %s:\n%s",
+                late, describe(frames[0]),
+                ' <- '.join(describe(f) for f in frames[1:]) or 'the event loop',
+                ''.join(traceback.format_stack(frame)))
+
+
+LOOP_WATCHDOG = LoopWatchdog()
@@ -0,0 +1,102 @@
+"""Tests of the Broadlink conversions against the original implementation."""
+import math
+import random
+import struct
+
+import pytest
+
+from custom_components.smartir import codec
+
+
+def _baseline_lirc2broadlink(pulses):
+    array = bytearray()
+
+    for pulse in pulses:
+        pulse = int(pulse * 269 / 8192)
+
+        if pulse < 256:
+            array += bytearray(struct.pack('>B', pulse))
+        else:
+            array += bytearray([0x00])
+            array += bytearray(struct.pack('>H', pulse))
+
+    packet = bytearray([0x26, 0x00])
+    packet += bytearray(struct.pack('<H', len(array)))
+    packet += array
+    packet += bytearray([0x0d, 0x05])
+
+    remainder = (len(packet) + 4) % 16
+    if remainder:
+        packet += bytearray(16 - remainder)
+    return packet
+
+
+def _baseline_broadlink2lirc(pulses):
+    result = list()
+    if pulses[0] != 0x26:
+        raise Exception("This broadlink data is not IR data")
+    ix = 4
+    mPulses = memoryview(pulses)
+    while ix < len(pulses):
+        current = pulses[ix]
+        if current == 0:
+            ix += 1
+            subview = mPulses[ix:ix + 2]
+            current = struct.unpack('>H', subview)[0]
+            ix += 1
+        current = math.floor(current / 269 * 8192)
+        result.append(current)
+        if mPulses[ix:ix + 3] == b'\x00\x0d\x05':
+            break
+        ix += 1
+    return result
+
+
+def _frames():
+    frames = [
+        [9000, 4500, 560, 560, 560, 1690, 560, 7797],
+        [9000, 4500, 560, 560, 560, 1690, 560, 15600],
+        [9000, 4500, 560, 560, 560, 1690, 560],
+        [560],
+        [],
+    ]
+    rand = random.Random(0)
+    for _ in range(200):
+        frames.append([rand.choice((rand.randint(1, 7000), rand.randint(7000, 60000)))
+                       for _ in range(rand.randint(1, 40))])
+    return frames
+
+
+def _outcome(convert, *args):
+    try:
+        return convert(*args)
+    except struct.error:
+        return struct.error
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def path(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(codec, 'np', None)
+    return request.param
+
+
+def test_lirc2broadlink_matches_the_original(path):
+    frames = _frames()
+
+    assert codec.lirc2broadlink_many(frames) == [_baseline_lirc2broadlink(f) for f in frames]
+    assert _outcome(codec.lirc2broadlink, [560, -100]) is struct.error
+    assert _outcome(codec.lirc2broadlink, [560, 2500000]) is struct.error
+
+
+def test_broadlink2lirc_matches_the_original(path):
+    packets = [bytes(_baseline_lirc2broadlink(f)) for f in _frames()]
+    # a 16 bit length cut off by the end of the packet
+    packets.append(bytes([0x26, 0x00, 0x03, 0x00, 0x10, 0x00, 0x01]))
+
+    for packet in packets:
+        assert _outcome(codec.broadlink2lirc, packet) == \
+            _outcome(_baseline_broadlink2lirc, packet)
+    assert codec.broadlink2lirc(packets[0]) == [8983, 4476, 548, 548, 548, 1674, 548, 7796]
@@ -0,0 +1,114 @@
+"""Tests of the lazily read command trees of device files and code packs."""
+import asyncio
+import json
+
+import pytest
+
+from custom_components.smartir import codepack
+from custom_components.smartir.commands import COMMAND_STORE, CommandNode, JsonCommandSource
+
+# an OpenMQTTGateway device file, whose commands are Json objects
+DEVICE = {
+    "manufacturer": "Test",
+    "supportedController": "MQTT",
+    "commandsEncoding": "Raw",
+    "commands": {
+        "off": {"protocol_name": "Raw", "raw": "9000,4500,560,560"},
+        "on": {"protocol_name": "NEC", "value": 16753245, "bits": 32},
+        "cool": {
+            "auto": {
+                "18": {"protocol_name": "Raw", "raw": "9000,4500,560,1690"},
+                "19": "9000,4500,560,560",
+            },
+        },
+    },
+}
+
+
+@pytest.fixture
+def device_file(tmp_path):
+    path = tmp_path / '1000.json'
+    path.write_text(json.dumps(DEVICE, indent=2))
+    return str(path)
+
+
+def _commands_of_json(path):
+    return JsonCommandSource(path).device_data['commands']
+
+
+def _commands_of_pack(path):
+    return codepack.CodePack(codepack.compile_file(path)).device_data['commands']
+
+
+@pytest.mark.parametrize('load', [_commands_of_json, _commands_of_pack])
+def test_object_commands_are_leaves(device_file, load):
+    commands = load(device_file)
+
+    assert commands['off'] == DEVICE['commands']['off']
+    assert type(commands['off']) is dict
+    assert commands['on'] == DEVICE['commands']['on']
+
+    levels = commands['cool']['auto']
+    assert isinstance(levels, CommandNode)
+    assert levels['18'] == DEVICE['commands']['cool']['auto']['18']
+    assert levels['19'] == DEVICE['commands']['cool']['auto']['19']
+
+
+def test_changed_json_file_is_indexed_again(device_file, tmp_path):
+    source = JsonCommandSource(device_file)
+    commands = source.device_data['commands']
+    auto = commands['cool']['auto']
+    assert auto['19'] == '9000,4500,560,560'
+
+    changed = json.loads(json.dumps(DEVICE))
+    changed['commands']['cool']['auto']['19'] = '9000,4500,560,1690,560,560'
+    del changed['commands']['on']
+    replacement = tmp_path / 'update.json'
+    replacement.write_text(json.dumps(changed))
+    replacement.replace(device_file)
+    # the next lookup checks the file again
+    source._checked -= 3600
+
+    assert auto['19'] == '9000,4500,560,1690,560,560'
+    assert commands['off'] == DEVICE['commands']['off']
+    assert 'on' not in commands
+
+
+def test_changed_json_file_is_indexed_again_in_the_executor(device_file, tmp_path):
+    source = JsonCommandSource(device_file)
+    auto = source.device_data['commands']['cool']['auto']
+
+    changed = json.loads(json.dumps(DEVICE))
+    changed['commands']['cool']['auto']['19'] = '9000,4500,560,1690,560,560'
+    replacement = tmp_path / 'update.json'
+    replacement.write_text(json.dumps(changed))
+    replacement.replace(device_file)
+    source._checked -= 3600
+
+    async def main():
+        # the lookup doesn't wait for the file to be read again
+        before = auto['19']
+        reload = source._reload
+        await reload
+        return before, auto['19']
+
+    before, after = asyncio.run(main())
+    assert before == '9000,4500,560,560'
+    assert after == '9000,4500,560,1690,560,560'
+
+
+def test_released_commands_leave_the_store(device_file):
+    first = JsonCommandSource(device_file).device_data['commands']
+    second = _commands_of_pack(device_file)
+    command = ''.join(['9000,4500,', '560,560'])
+    store = COMMAND_STORE._commands
+    # held by the sources of the other tests
+    held = store[command][1] if command in store else 0
+
+    assert first['cool']['auto']['19'] is second['cool']['auto']['19']
+    assert store[command][1] == held + 2
+
+    first.close()
+    assert store[command][1] == held + 1
+    second.close()
+    assert store.get(command, [None, 0])[1] == held
@@ -0,0 +1,22 @@
+"""Tests of the recognition of IR protocol frames."""
+import pytest
+
+from custom_components.smartir import protocols
+
+
+@pytest.mark.parametrize('name, value, bits', [
+    (protocols.NEC, 0x20DF10EF, 32),
+    (protocols.SAMSUNG, 0xE0E040BF, 32),
+    (protocols.SONY, 0xA90, 12),
+])
+@pytest.mark.parametrize('repeat', [0, 2])
+def test_encoded_frames_are_decoded(name, value, bits, repeat):
+    pulses = protocols.encode(name, value, bits, repeat)
+
+    assert protocols.decode(pulses) == (name, value, bits, repeat)
+
+
+def test_nec_frame_with_copies_is_not_recognised():
+    frame = protocols.encode(protocols.NEC, 0x20DF10EF, 32)
+
+    assert protocols.decode(frame + [40000] + frame) is None
@@ -0,0 +1,62 @@
+"""Tests of the ordering of the sends to one IR transmitter."""
+import asyncio
+import time
+
+import pytest
+
+from custom_components.smartir.controllers import (
+    BROADLINK_CONTROLLER, XIAOMI_CONTROLLER, get_controller)
+from custom_components.smartir.controllers.scheduler import SendScheduler
+
+LATENCY = 0.05 # seconds a remote takes to send a frame
+MIN_GAP = 0.02
+
+
+class FakeServices():
+    """Remote services which send their frames after a delay."""
+
+    def __init__(self):
+        self.transmissions = []
+        self._tasks = []
+
+    async def _transmit(self):
+        start = time.monotonic()
+        await asyncio.sleep(LATENCY)
+        self.transmissions.append((start, time.monotonic()))
+
+    async def async_call(self, domain, service, service_data, blocking=False):
+        if blocking:
+            await self._transmit()
+        else:
+            self._tasks.append(asyncio.ensure_future(self._transmit()))
+
+    async def wait(self):
+        await asyncio.gather(*self._tasks)
+
+
+class FakeData():
+    def __init__(self, services):
+        self.hass = type('FakeHass', (), {'services': services})()
+        self._controller_data = 'remote.living_room'
+        self._delay = 0.5
+
+
+@pytest.mark.parametrize('name', [BROADLINK_CONTROLLER, XIAOMI_CONTROLLER])
+def test_frames_to_one_transmitter_do_not_overlap(name):
+    controller = get_controller(name)
+    services = FakeServices()
+    data = FakeData(services)
+    scheduler = SendScheduler(MIN_GAP)
+
+    async def main():
+        await asyncio.gather(*(
+            scheduler.run(controller.transmitter(data), controller._send, ['command'], data)
+            for _ in range(3)))
+        await services.wait()
+
+    asyncio.run(main())
+
+    transmissions = sorted(services.transmissions)
+    assert len(transmissions) == 3
+    for (_, end), (start, _) in zip(transmissions, transmissions[1:]):
+        assert start >= end + MIN_GAP * 0.9